@@ -0,0 +1,192 @@
+import io
+import sys
+import time
+import pickle
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+class GifRenderError(Exception):
+    pass
+
+TRANSPARENT = (255, 0, 255)
+
+def frame_grid(sheet: np.ndarray, width: int, height: int, order: str) -> np.ndarray:
+    rows, cols = sheet.shape[0] // height, sheet.shape[1] // width
+    grid = sheet[:rows * height, :cols * width].reshape(rows, height, cols, width, 4).swapaxes(1, 2)
+    if order == "rl_bt":
+        grid = grid[::-1, ::-1]
+    elif order == "tb_lr":
+        grid = grid.swapaxes(0, 1)
+    return grid.reshape(-1, height, width, 4)
+
+def non_empty_frames(frames: np.ndarray, alpha_threshold=10) -> np.ndarray:
+    return frames[frames[..., 3].max(axis=(1, 2)) > alpha_threshold]
+
+def is_frame_empty(frame: np.ndarray, alpha_threshold=10) -> bool:
+    return frame[..., 3].max() <= alpha_threshold
+
+def remove_alpha(frames: np.ndarray) -> tuple:
+    alpha = frames[..., 3:].astype(np.uint16)
+    background = np.array(TRANSPARENT, dtype=np.uint16)
+    rgb = ((frames[..., :3] * alpha + background * (255 - alpha) + 127) // 255).astype(np.uint8)
+    transparent = (alpha[..., 0] * alpha[..., 0] + 127) // 255 <= 128
+    return rgb, transparent
+
+def to_paletted(rgb: np.ndarray, transparent: np.ndarray) -> Image.Image:
+    paletted = Image.fromarray(rgb, "RGB").quantize(colors=255, method=Image.Quantize.FASTOCTREE)
+    indices = np.asarray(paletted, dtype=np.uint8) + 1
+    indices[transparent] = 0
+    result = Image.fromarray(indices, "P")
+    result.putpalette(list(TRANSPARENT) + paletted.getpalette()[:255 * 3])
+    return result
+
+def open_image(data: bytes, max_pixels: int) -> np.ndarray:
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > max_pixels:
+        raise GifRenderError(f"Изображение {image.width}×{image.height} слишком большое (максимум {max_pixels} пикселей).")
+    return np.asarray(image.convert("RGBA"))
+
+def slice_sheet(sheet: np.ndarray, width: int, height: int, order: str, max_frames: int) -> np.ndarray:
+    rows, cols = sheet.shape[0] // height, sheet.shape[1] // width
+    if rows * cols > max_frames:
+        raise GifRenderError(f"В спрайт-листе {rows * cols} кадров, максимум {max_frames}.")
+    return non_empty_frames(frame_grid(sheet, width, height, order))
+
+def encode_gif(frames, durations: list) -> bytes:
+    if isinstance(frames, np.ndarray):
+        rgb, transparent = remove_alpha(frames)
+        frames = [to_paletted(*pair) for pair in zip(rgb, transparent)]
+    else:
+        frames = [to_paletted(*remove_alpha(frame)) for frame in frames]
+    output = io.BytesIO()
+    frames[0].save(
+        output,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=0,
+        disposal=2,
+        transparency=0,
+        optimize=False,
+    )
+    return output.getvalue()
+
+def shared_palette(rgb: np.ndarray, transparent: np.ndarray) -> tuple:
+    count, height, width = transparent.shape
+    opaque = rgb[~transparent]
+    fill = opaque[0] if len(opaque) else np.zeros(3, dtype=np.uint8)
+    filled = np.where(transparent[..., None], fill, rgb).reshape(count * height, width, 3)
+    quantized = Image.fromarray(filled, "RGB").quantize(colors=255, method=Image.Quantize.FASTOCTREE)
+    indices = np.asarray(quantized, dtype=np.uint8).reshape(count, height, width) + 1
+    indices[transparent] = 0
+    return indices, list(TRANSPARENT) + quantized.getpalette()[:255 * 3]
+
+def bounding_box(mask: np.ndarray):
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+def union_box(a: tuple, b: tuple) -> tuple:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+def plan_frames(indices: np.ndarray, durations: list) -> list:
+    plans = []
+    for frame, duration in zip(indices, durations):
+        if plans and np.array_equal(plans[-1]["frame"], frame):
+            plans[-1]["duration"] += duration
+            continue
+        plans.append({"frame": frame, "duration": duration, "disposal": 1})
+    height, width = indices.shape[1:]
+    first = plans[0]
+    first.update(draw=np.ones((height, width), dtype=bool), box=(0, 0, width, height))
+    canvas = first["frame"]
+    for i in range(1, len(plans) + 1):
+        previous = plans[i - 1]
+        frame = plans[i % len(plans)]["frame"]
+        base = canvas
+        cleared = bounding_box((canvas != 0) & (frame == 0))
+        if cleared:
+            previous["box"] = union_box(previous["box"], cleared)
+            previous["disposal"] = 2
+            left, upper, right, lower = previous["box"]
+            base = canvas.copy()
+            base[upper:lower, left:right] = 0
+        if i == len(plans):
+            break
+        draw = frame != base
+        plans[i].update(draw=draw, box=bounding_box(draw) or (0, 0, 1, 1))
+        canvas = frame
+    return plans
+
+def encode_gif_shared(frames: np.ndarray, durations: list) -> tuple:
+    rgb, transparent = remove_alpha(frames)
+    indices, palette = shared_palette(rgb, transparent)
+    plans = plan_frames(indices, durations)
+    height, width = indices.shape[1:]
+    screen = Image.new("P", (width, height), 0)
+    screen.putpalette(palette)
+    header, _ = GifImagePlugin.getheader(screen, info={"loop": 0, "transparency": 0, "background": 0})
+    chunks = list(header)
+    for plan in plans:
+        left, upper, right, lower = plan["box"]
+        region = np.where(plan["draw"], plan["frame"], 0)[upper:lower, left:right]
+        chunks += GifImagePlugin.getdata(
+            Image.fromarray(np.ascontiguousarray(region), "P"),
+            (left, upper),
+            duration=plan["duration"],
+            disposal=plan["disposal"],
+            transparency=0,
+        )
+    chunks.append(b";")
+    return b"".join(chunks), len(plans)
+
+def render_gif(job: dict) -> tuple:
+    max_pixels = job["max_pixels"]
+    durations = job["durations"]
+    if job["sheet"]:
+        sheet = open_image(job["images"][0], max_pixels)
+        frames = slice_sheet(sheet, job["width"], job["height"], job["order"], job["max_frames"])
+        if durations is None:
+            durations = [600] * len(frames)
+        if job["trim_durations"] and len(durations) > len(frames):
+            durations = durations[:len(frames)]
+        if job["strict_durations"] and len(durations) != len(frames):
+            raise GifRenderError(f"Количество длительностей ({len(durations)}) не совпадает с числом кадров ({len(frames)}).")
+    else:
+        if len(durations) != len(job["images"]):
+            raise GifRenderError(f"Количество длительностей ({len(durations)}) не совпадает с количеством изображений ({len(job['images'])}).")
+        kept = [(frame, duration) for frame, duration in zip((open_image(data, max_pixels) for data in job["images"]), durations) if not is_frame_empty(frame)]
+        frames = [frame for frame, duration in kept]
+        durations = [duration for frame, duration in kept]
+    if not len(frames):
+        raise GifRenderError("В изображениях не найдено ни одного непустого кадра.")
+    if len(durations) != len(frames):
+        raise GifRenderError(f"Количество длительностей ({len(durations)}) не совпадает с числом непустых кадров ({len(frames)}).")
+    stats = {"frames": len(frames), "written_frames": len(frames), "baseline_bytes": None}
+    started = time.perf_counter()
+    uniform = isinstance(frames, np.ndarray) or len({frame.shape for frame in frames}) == 1
+    if job.get("encoder", "shared") == "shared" and uniform:
+        data, stats["written_frames"] = encode_gif_shared(np.asarray(frames), durations)
+        stats["encoder"] = "shared"
+    else:
+        data = encode_gif(frames, durations)
+        stats["encoder"] = "per_frame"
+    stats["encode_ms"] = (time.perf_counter() - started) * 1000
+    stats["bytes"] = len(data)
+    if job.get("report_savings") and stats["encoder"] == "shared":
+        stats["baseline_bytes"] = len(encode_gif(frames, durations))
+    return data, stats
+
+def main():
+    job = pickle.load(sys.stdin.buffer)
+    try:
+        result = ("ok", render_gif(job))
+    except GifRenderError as e:
+        result = ("error", str(e))
+    pickle.dump(result, sys.stdout.buffer)
+
+if __name__ == "__main__":
+    main()
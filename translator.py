@@ -0,0 +1,130 @@
+import re
+import logging
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r"(\w+)|(\W+)")
+WORD_RE = re.compile(r"\w+")
+PHRASE_GAP_RE = re.compile(r"[ \t\-]+")
+TERMINAL = None
+
+def tokenize(text: str) -> list:
+    return [(match.group(0), match.group(1) is not None) for match in TOKEN_RE.finditer(text)]
+
+def build_trie(pairs) -> tuple:
+    trie = {}
+    collisions = {}
+    for source, target in pairs:
+        words = WORD_RE.findall(source.lower())
+        if not words:
+            continue
+        node = trie
+        for word in words:
+            node = node.setdefault(word, {})
+        if TERMINAL in node:
+            if node[TERMINAL] != target:
+                collisions.setdefault(" ".join(words), [node[TERMINAL]]).append(target)
+            continue
+        node[TERMINAL] = target
+    return trie, collisions
+
+def match_case(source: str, replacement: str) -> str:
+    if len(source) > 1 and source.isupper():
+        return replacement.upper()
+    if source[:1].isupper():
+        return replacement[:1].upper() + replacement[1:]
+    return replacement
+
+def trie_depth(trie: dict) -> int:
+    return max((trie_depth(node) + 1 for word, node in trie.items() if word is not TERMINAL), default=0)
+
+def translate_tokens(tokens: list, trie: dict, stop: int = None) -> tuple:
+    result = []
+    i = 0
+    count = len(tokens)
+    while i < (count if stop is None else stop):
+        token, is_word = tokens[i]
+        if not is_word:
+            result.append(token)
+            i += 1
+            continue
+        node = trie
+        best = None
+        j = i
+        while j < count:
+            word, word_token = tokens[j]
+            if not word_token:
+                break
+            node = node.get(word.lower())
+            if node is None:
+                break
+            if TERMINAL in node:
+                best = (j, node[TERMINAL])
+            if j + 2 < count and PHRASE_GAP_RE.fullmatch(tokens[j + 1][0]):
+                j += 2
+            else:
+                break
+        if best is None:
+            result.append(token)
+            i += 1
+        else:
+            end, replacement = best
+            result.append(match_case(token, replacement))
+            i = end + 1
+    return "".join(result), i
+
+def translate_text(text: str, trie: dict) -> str:
+    return translate_tokens(tokenize(text), trie)[0]
+
+class Translator:
+    def __init__(self, translations: dict, cache_size: int = 256):
+        self.forward, forward_collisions = build_trie(translations.items())
+        self.reverse, reverse_collisions = build_trie((target, source) for source, target in translations.items())
+        self.collisions = {"ru_to_tuga": forward_collisions, "tuga_to_ru": reverse_collisions}
+        for direction, collisions in self.collisions.items():
+            if collisions:
+                logging.warning(
+                    f"Коллизии словаря ({direction}): {len(collisions)} — используется первый вариант: "
+                    + "; ".join(f"{phrase}: {', '.join(options)}" for phrase, options in list(collisions.items())[:10])
+                )
+        self._translate = lru_cache(maxsize=cache_size)(self._translate_uncached)
+
+    def _translate_uncached(self, text: str, direction: str) -> str:
+        trie = self.reverse if direction == "tuga_to_ru" else self.forward
+        return translate_text(text, trie)
+
+    def translate(self, text: str, direction: str) -> str:
+        return self._translate(text, direction)
+
+    def stream(self, direction: str, max_buffer: int = 65536) -> "StreamTranslator":
+        trie = self.reverse if direction == "tuga_to_ru" else self.forward
+        return StreamTranslator(trie, max_buffer)
+
+    def cache_info(self):
+        return self._translate.cache_info()
+
+class StreamTranslator:
+    def __init__(self, trie: dict, max_buffer: int = 65536):
+        self.trie = trie
+        self.max_buffer = max_buffer
+        self.lookahead = 2 * trie_depth(trie) + 1
+        self.buffer = ""
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        cut = self.buffer.rfind("\n") + 1
+        if cut:
+            ready, self.buffer = self.buffer[:cut], self.buffer[cut:]
+            return translate_text(ready, self.trie)
+        if len(self.buffer) <= self.max_buffer:
+            return ""
+        tokens = tokenize(self.buffer)
+        stop = len(tokens) - 1 - self.lookahead
+        if stop <= 0:
+            return ""
+        ready, done = translate_tokens(tokens, self.trie, stop)
+        self.buffer = self.buffer[sum(len(token) for token, is_word in tokens[:done]):]
+        return ready
+
+    def finish(self) -> str:
+        ready, self.buffer = self.buffer, ""
+        return translate_text(ready, self.trie)
@@ -5,9 +5,12 @@ from discord.ui import View, Button, Modal, TextInput
 import requests
 import logging
 import asyncio
-from datetime import datetime, timedelta, UTC
+from datetime import datetime, UTC
 import os
 import json
+import tempfile
+import codecs
+import shutil
 from dotenv import load_dotenv
 import re
 import random
@@ -15,9 +18,21 @@ from PIL import Image, ImageDraw, ImageFont
 import io
 from typing import Optional
 import gspread
+from gspread.utils import rowcol_to_a1, absolute_range_name
 from oauth2client.service_account import ServiceAccountCredentials
 import math
 import aiohttp
+import time
+from translator import Translator
+from gif_renderer import GifRenderError
+import sys
+import pickle
+import hashlib
+import bisect
+import difflib
+from collections import OrderedDict, deque
+from html.parser import HTMLParser
+from email.utils import parsedate_to_datetime
 
 load_dotenv()
 
@@ -26,32 +41,477 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
     logging.FileHandler("bot_log.txt", mode="a")
 ])
 
+class WikiBot(commands.Bot):
+    async def setup_hook(self):
+        await http_client.start()
+
+    async def close(self):
+        await flush_config()
+        try:
+            await sheets.flush()
+        except Exception as e:
+            logging.error(f"Не удалось записать изменения в Google Sheets при остановке: {e}")
+        await http_client.close()
+        await gif_jobs.close()
+        await super().close()
+
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="/", intents=intents)
+bot = WikiBot(command_prefix="/", intents=intents)
 CONFIG_FILE = "bot_config.json"
+STATE_FILE = "bot_state.json"
+CONTENT_DIR = "data"
+CONTENT_FILES = {
+    "translations": "translations.json",
+    "responses": "responses.json",
+    "flags": "flags.json",
+    "training_texts": "training_texts.json",
+}
+STATE_KEYS = (
+    "message_ids", "message_id", "leaderboard_message_id", "monthly_winner_user_id",
+    "auto_pin", "is_updating", "is_lb_updating", "monthly_event_enabled",
+    "auto_threads", "game_room",
+)
 LOG_FILE = "bot_log.txt"
+CONFIG_SAVE_DELAY = 2
 MAX_LINES = 5000
 MAX_FIELD_LENGTH = 1024
+EMBED_DESCRIPTION_LIMIT = 4096
+MESSAGE_EMBED_CHARS = 6000
+MESSAGE_EMBEDS = 10
+TRANSLATE_FILE_EXTENSIONS = (".txt", ".md")
+TRANSLATE_FILE_MAX_BYTES = 4 * 1024 * 1024
+TRANSLATE_CHUNK_SIZE = 64 * 1024
+TRANSLATE_SPOOL_SIZE = 1024 * 1024
 # free_column_tasks = []
 cached_tasks = []
-mention_times = []
-ignore_until = datetime.min.replace(tzinfo=UTC)
+task_board_state = {"hash": None, "column_hashes": {}, "page_hashes": [], "skipped": 0, "edited": 0}
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 creds = ServiceAccountCredentials.from_json_keyfile_name(os.getenv('GOOGLE_CREDS_JSON'), scope)
 gc = gspread.authorize(creds)
 
+def load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_content() -> dict:
+    content = {}
+    for key, filename in CONTENT_FILES.items():
+        path = os.path.join(CONTENT_DIR, filename)
+        if os.path.exists(path):
+            content[key] = load_json(path)
+        else:
+            logging.warning(f"Файл контента не найден: {path}")
+    return content
+
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    raise FileNotFoundError("Файл конфигурации не найден.")
+    if not os.path.exists(CONFIG_FILE):
+        raise FileNotFoundError("Файл конфигурации не найден.")
+    data = load_json(CONFIG_FILE)
+    data.update(load_content())
+    if os.path.exists(STATE_FILE):
+        data.update(load_json(STATE_FILE))
+    return data
+
+def runtime_state(data: dict) -> dict:
+    return {key: data[key] for key in STATE_KEYS if key in data}
+
+def write_config_file(data: str):
+    directory = os.path.dirname(os.path.abspath(STATE_FILE))
+    fd, temp_path = tempfile.mkstemp(prefix=".bot_state.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(STATE_FILE):
+            shutil.copymode(STATE_FILE, temp_path)
+        os.replace(temp_path, STATE_FILE)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+config_state = {"data": None, "dirty": False, "task": None, "lock": None, "writes": 0}
 
 def save_config(new_data: dict):
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(new_data, f, ensure_ascii=False, indent=2)
+    config_state["data"] = new_data
+    config_state["dirty"] = True
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        write_config_file(json.dumps(runtime_state(new_data), ensure_ascii=False, indent=2))
+        config_state["dirty"] = False
+        config_state["writes"] += 1
+        return
+    if config_state["task"] is None or config_state["task"].done():
+        config_state["task"] = loop.create_task(save_config_later())
+
+async def save_config_later():
+    while True:
+        await asyncio.sleep(CONFIG_SAVE_DELAY)
+        await flush_config()
+        if not config_state["dirty"]:
+            return
+
+async def flush_config():
+    if config_state["lock"] is None:
+        config_state["lock"] = asyncio.Lock()
+    async with config_state["lock"]:
+        if not config_state["dirty"]:
+            return
+        config_state["dirty"] = False
+        data = json.dumps(runtime_state(config_state["data"]), ensure_ascii=False, indent=2)
+        try:
+            await asyncio.to_thread(write_config_file, data)
+            config_state["writes"] += 1
+        except Exception as e:
+            config_state["dirty"] = True
+            logging.error(f"Не удалось сохранить конфигурацию: {e}")
 
 config = load_config()
 
+QUERY_WORD_RE = re.compile(r"\b\w+\b")
+
+class IntentMatcher:
+    def __init__(self, flags: dict, responses: dict):
+        self.bits = {}
+        self.keywords = {}
+        for flag, keywords in flags.items():
+            bit = self.bit(flag)
+            for kw in keywords:
+                kw = kw.lower()
+                self.keywords[kw] = self.keywords.get(kw, 0) | bit
+        masks = []
+        for key in responses:
+            mask = 0
+            for part in set(key.split("+")):
+                mask |= self.bit(part)
+            masks.append((mask, key))
+        self.responses = sorted(masks, key=lambda entry: -len(entry[1].split("+")))
+        trigger_words = flags.get("M", [])
+        self.trigger_re = re.compile(
+            r"\b(" + "|".join(re.escape(w) for w in trigger_words) + r")\b", re.IGNORECASE
+        ) if trigger_words else None
+
+    def bit(self, flag: str) -> int:
+        if flag not in self.bits:
+            self.bits[flag] = 1 << len(self.bits)
+        return self.bits[flag]
+
+    def match(self, words) -> int:
+        mask = 0
+        keywords = self.keywords
+        for word in words:
+            mask |= keywords.get(word, 0)
+        return mask
+
+    def has(self, mask: int, flag: str) -> bool:
+        return bool(mask & self.bits.get(flag, 0))
+
+    def response_key(self, mask: int):
+        for key_mask, key in self.responses:
+            if key_mask & ~mask == 0:
+                return key
+        return None
+
+translator = None
+intent_matcher = None
+
+def build_content_indexes():
+    global translator, intent_matcher
+    translator = Translator(config.get("translations", {}))
+    intent_matcher = IntentMatcher(config.get("flags", {}), config.get("responses", {}))
+
+def apply_content(content: dict):
+    config.update(content)
+    build_content_indexes()
+
+build_content_indexes()
+
+def parse_points(value) -> int:
+    try:
+        return int(float(str(value).strip()))
+    except (TypeError, ValueError):
+        return 0
+
+def build_nick_index(rows: list) -> dict:
+    index = {}
+    for i, row in enumerate(rows):
+        if row and row[0].strip():
+            index.setdefault(row[0].strip(), (i + 1, parse_points(row[1]) if len(row) > 1 else 0))
+    return index
+
+class SheetsGateway:
+    def __init__(self, client, sheet_id: str, max_concurrency: int = 4, write_window: float = 0.2, snapshot_ttl: float = 60):
+        self.client = client
+        self.sheet_id = sheet_id
+        self.write_window = write_window
+        self.snapshot_ttl = snapshot_ttl
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._snapshots = {}
+        self._snapshot_locks = {}
+        self._pending = {}
+        self._inflight = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._open_lock = asyncio.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def spreadsheet(self):
+        if self._spreadsheet is None:
+            async with self._open_lock:
+                if self._spreadsheet is None:
+                    self._spreadsheet = await self.run(self.client.open_by_key, self.sheet_id)
+        return self._spreadsheet
+
+    async def worksheet(self, name: str):
+        ws = self._worksheets.get(name)
+        if ws is None:
+            sh = await self.spreadsheet()
+            ws = await self.run(sh.worksheet, name)
+            self._worksheets[name] = ws
+        return ws
+
+    async def snapshot(self, name: str, fresh: bool = False) -> dict:
+        snap = self._snapshots.get(name)
+        if not fresh and snap and time.monotonic() - snap["loaded_at"] < self.snapshot_ttl:
+            return snap
+        lock = self._snapshot_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            current = self._snapshots.get(name)
+            if current is not None and current is not snap:
+                return current
+            ws = await self.worksheet(name)
+            queued = self._queued_batches(name)
+            rows = await self.run(ws.get_all_values)
+            snap = {"rows": rows, "index": build_nick_index(rows), "loaded_at": time.monotonic()}
+            self._snapshots[name] = snap
+            for batch in queued + [batch for batch in self._queued_batches(name) if batch not in queued]:
+                for (row, col), value in batch["cells"].items():
+                    self._patch_cell(name, row, col, value)
+                for values in batch["rows"]:
+                    if values and str(values[0]).strip() not in snap["index"]:
+                        self._patch_append(name, values)
+            return snap
+
+    def _queued_batches(self, name: str) -> list:
+        return [batch for batch in (self._inflight.get(name), self._pending.get(name)) if batch is not None]
+
+    def invalidate(self, name: str = None):
+        if name is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(name, None)
+
+    async def get_all_values(self, name: str, fresh: bool = False) -> list:
+        snap = await self.snapshot(name, fresh)
+        return snap["rows"]
+
+    async def lookup(self, name: str, nick: str):
+        snap = await self.snapshot(name)
+        return snap["index"].get(nick)
+
+    def _patch_cell(self, name: str, row: int, col: int, value):
+        snap = self._snapshots.get(name)
+        if snap is None:
+            return
+        rows = snap["rows"]
+        while len(rows) < row:
+            rows.append([])
+        cells = rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = str(value)
+        if col == 1:
+            snap["index"] = build_nick_index(rows)
+        elif col == 2:
+            nick = cells[0].strip()
+            if nick and snap["index"].get(nick, (None,))[0] == row:
+                snap["index"][nick] = (row, parse_points(value))
+
+    def _patch_append(self, name: str, values: list):
+        snap = self._snapshots.get(name)
+        if snap is None:
+            return
+        snap["rows"].append([str(v) for v in values])
+        nick = str(values[0]).strip() if values else ""
+        if nick:
+            snap["index"].setdefault(nick, (len(snap["rows"]), parse_points(values[1]) if len(values) > 1 else 0))
+
+    def _batch(self, name: str) -> dict:
+        batch = self._pending.get(name)
+        if batch is None:
+            batch = {
+                "cells": {},
+                "rows": [],
+                "future": asyncio.get_running_loop().create_future(),
+                "timer": asyncio.create_task(self._flush_later(name)),
+            }
+            self._pending[name] = batch
+        return batch
+
+    def queue_cell(self, name: str, row: int, col: int, value) -> asyncio.Future:
+        batch = self._batch(name)
+        batch["cells"][(row, col)] = value
+        self._patch_cell(name, row, col, value)
+        return batch["future"]
+
+    def queue_append(self, name: str, values: list) -> asyncio.Future:
+        batch = self._batch(name)
+        batch["rows"].append(values)
+        self._patch_append(name, values)
+        return batch["future"]
+
+    async def _flush_later(self, name: str):
+        await asyncio.sleep(self.write_window)
+        await self._flush_sheet(name)
+
+    async def _flush_sheet(self, name: str):
+        batch = self._pending.pop(name, None)
+        if batch is None:
+            return
+        if batch["timer"] is not asyncio.current_task():
+            batch["timer"].cancel()
+        future = batch["future"]
+        self._inflight[name] = batch
+        try:
+            ws = await self.worksheet(name)
+            if batch["cells"]:
+                data = [{"range": rowcol_to_a1(row, col), "values": [[value]]} for (row, col), value in batch["cells"].items()]
+                await self.run(ws.batch_update, data, value_input_option="USER_ENTERED")
+            if batch["rows"]:
+                await self.run(ws.append_rows, batch["rows"])
+            logging.info(f"Лист '{name}': записано ячеек {len(batch['cells'])}, строк добавлено {len(batch['rows'])}")
+        except Exception as e:
+            logging.error(f"Ошибка при пакетной записи в лист '{name}': {e}")
+            self.invalidate(name)
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            if self._inflight.get(name) is batch:
+                del self._inflight[name]
+        if not future.done():
+            future.set_result(None)
+
+    async def flush(self, name: str = None):
+        names = [name] if name is not None else list(self._pending)
+        futures = [self._pending[n]["future"] for n in names if n in self._pending]
+        futures += [self._inflight[n]["future"] for n in ([name] if name is not None else list(self._inflight)) if n in self._inflight]
+        for n in names:
+            await self._flush_sheet(n)
+        if futures:
+            await asyncio.gather(*futures)
+
+    async def update_cell(self, name: str, row: int, col: int, value):
+        await self.queue_cell(name, row, col, value)
+
+    async def append_row(self, name: str, values: list):
+        await self.queue_append(name, values)
+
+    async def clear(self, name: str):
+        await self.flush(name)
+        ws = await self.worksheet(name)
+        result = await self.run(ws.clear)
+        self.invalidate(name)
+        return result
+
+    async def ensure_rows(self, name: str, count: int):
+        ws = await self.worksheet(name)
+        if ws.row_count < count:
+            await self.run(ws.add_rows, count - ws.row_count)
+
+    async def batch_write(self, writes: list):
+        await self.flush()
+        sh = await self.spreadsheet()
+        body = {
+            "valueInputOption": "USER_ENTERED",
+            "data": [{"range": absolute_range_name(name, cells), "values": values} for name, cells, values in writes],
+        }
+        try:
+            return await self.run(sh.values_batch_update, body)
+        finally:
+            for name in {name for name, _, _ in writes}:
+                self.invalidate(name)
+
+    async def ensure_cols(self, name: str, count: int):
+        ws = await self.worksheet(name)
+        if ws.col_count < count:
+            await self.run(ws.add_cols, count - ws.col_count)
+
+sheets = SheetsGateway(
+    gc,
+    config['leaderboard_sheet_id'],
+    config.get("sheets_max_concurrency", 4),
+    config.get("sheets_write_window", 0.2),
+    config.get("sheets_snapshot_ttl", 60)
+)
+
+class HttpClient:
+    def __init__(self, limit_per_host: int = 10, dns_ttl: int = 300, timeout: float = 30, connect_timeout: float = 10):
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=60,
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            logging.info("HTTP-сессия создана.")
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logging.info("HTTP-сессия закрыта.")
+        self.session = None
+
+    async def request(self, method: str, url: str, **kwargs):
+        session = await self.start()
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            return response.status, response.headers, body
+
+def decode_json(body: bytes):
+    if not body or not body.strip():
+        return None
+    return json.loads(body)
+
+http_client = HttpClient(
+    config.get("http_limit_per_host", 10),
+    config.get("http_dns_ttl", 300),
+    config.get("http_timeout", 30),
+    config.get("http_connect_timeout", 10)
+)
+
+class ChannelResolver:
+    def __init__(self, client: commands.Bot):
+        self.client = client
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, channel_id):
+        channel_id = int(channel_id)
+        channel = self.client.get_channel(channel_id)
+        if channel is not None:
+            self.hits += 1
+            return channel
+        self.misses += 1
+        logging.info(f"Канал {channel_id} не найден в кэше, запрашиваем через API (попаданий: {self.hits}, промахов: {self.misses}).")
+        return await self.client.fetch_channel(channel_id)
+
+channel_resolver = ChannelResolver(bot)
+
 async def clear_log_if_too_big():
     try:
         with open(LOG_FILE, "rb") as f:
@@ -77,7 +537,7 @@ async def clear_log_if_too_big():
             with open(temp_path, "w", encoding="utf-8") as f:
                 f.writelines(scrubbed_lines)
             try:
-                archive_channel = await bot.fetch_channel(config['log_channel_id'])
+                archive_channel = await channel_resolver.get(config['log_channel_id'])
                 if archive_channel:
                     file = discord.File(temp_path, filename="bot_log_redacted.txt")
                     await archive_channel.send(
@@ -98,27 +558,176 @@ async def clear_log_if_too_big():
     except Exception as e:
         logging.error(f"Ошибка при проверке размера лога: {e}")
 
-async def get_tasks_from_yougile(column_id):
+async def get_tasks_from_yougile(column_id, page_limit: int = 1000):
     url = "https://ru.yougile.com/api-v2/task-list"
     headers = {
         'Authorization': f"Bearer {os.getenv('YOUGILE_API_TOKEN')}",
         'Content-Type': 'application/json'
     }
-    params = {"columnId": column_id}
+    tasks = []
+    offset = 0
     try:
         logging.info(f"Запрос задач из колонки: {column_id}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=10) as response:
-                response.raise_for_status()
-                text = await response.text()
-                if not text.strip():
-                    logging.warning(f"Пустой ответ от YouGile для колонки {column_id}")
-                    return []
-                data = await response.json()
-                return data.get("content", [])
+        while True:
+            params = {"columnId": column_id, "limit": page_limit, "offset": offset}
+            status, _, body = await http_client.request("GET", url, headers=headers, params=params, timeout=aiohttp.ClientTimeout(total=10))
+            if status != 200:
+                logging.error(f"YouGile вернул {status} для колонки {column_id}")
+                return None
+            data = decode_json(body)
+            if data is None:
+                logging.warning(f"Пустой ответ от YouGile для колонки {column_id}")
+                return None
+            page = data.get("content", [])
+            tasks.extend(task for task in page if not task.get("deleted"))
+            paging = data.get("paging", {})
+            if not paging.get("next", len(page) >= page_limit) or not page:
+                return tasks
+            offset += len(page)
     except Exception as e:
         logging.error(f"Ошибка при запросе: {e}")
-        return []
+        return None
+
+class TaskStore:
+    def __init__(self):
+        self.tasks = {}
+        self.digests = {}
+        self.last_seen = {}
+        self.columns = {}
+        self.synced_at = {}
+
+    def apply(self, column_id: str, tasks: list) -> dict:
+        now = datetime.now(UTC)
+        previous_ids = set(self.columns.get(column_id, []))
+        current_ids = []
+        added, updated = [], []
+        for task in tasks:
+            task_id = task.get("id")
+            if not task_id:
+                continue
+            digest = hashlib.sha256(json.dumps(task, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+            if task_id not in self.tasks:
+                added.append(task_id)
+            elif self.digests.get(task_id) != digest:
+                updated.append(task_id)
+            if self.digests.get(task_id) != digest:
+                self.tasks[task_id] = task
+                self.digests[task_id] = digest
+            self.last_seen[task_id] = now
+            current_ids.append(task_id)
+        current_set = set(current_ids)
+        removed = [task_id for task_id in previous_ids if task_id not in current_set]
+        self.columns[column_id] = current_ids
+        self.synced_at[column_id] = now
+        owned = {task_id for ids in self.columns.values() for task_id in ids}
+        for task_id in removed:
+            if task_id not in owned:
+                self.tasks.pop(task_id, None)
+                self.digests.pop(task_id, None)
+                self.last_seen.pop(task_id, None)
+        return {"added": added, "updated": updated, "removed": removed}
+
+    def column_tasks(self, column_id: str) -> list:
+        return [self.tasks[task_id] for task_id in self.columns.get(column_id, []) if task_id in self.tasks]
+
+    def all_tasks(self) -> list:
+        return list(self.tasks.values())
+
+task_store = TaskStore()
+
+def normalize_title(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    return " ".join(re.findall(r"\w+", text))
+
+class TaskIndex:
+    def __init__(self):
+        self.tasks = []
+        self.exact = {}
+        self.titles = []
+        self.tokens = {}
+        self.token_keys = []
+
+    def rebuild(self, tasks: list):
+        self.tasks = [task for task in tasks if task.get("title")]
+        self.exact = {}
+        tokens = {}
+        titles = []
+        for i, task in enumerate(self.tasks):
+            normalized = normalize_title(task["title"])
+            self.exact.setdefault(normalized, i)
+            titles.append((normalized, i))
+            for token in set(normalized.split()):
+                tokens.setdefault(token, set()).add(i)
+        self.titles = sorted(titles)
+        self.tokens = tokens
+        self.token_keys = sorted(tokens)
+
+    def _prefix_range(self, keys: list, prefix: str):
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff")
+        return start, end
+
+    def find(self, query: str):
+        i = self.exact.get(normalize_title(query))
+        if i is not None:
+            return self.tasks[i]
+        results = self.search(query, 1)
+        return results[0] if results else None
+
+    def search(self, query: str, limit: int = 25) -> list:
+        normalized = normalize_title(query)
+        if not normalized:
+            return [self.tasks[i] for _, i in self.titles[:limit]]
+        found = []
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+
+        if normalized in self.exact:
+            add(self.exact[normalized])
+        start = bisect.bisect_left(self.titles, (normalized, -1))
+        end = bisect.bisect_left(self.titles, (normalized + "\uffff", -1))
+        for _, i in self.titles[start:end]:
+            if len(found) >= limit:
+                break
+            add(i)
+        if len(found) < limit:
+            matches = None
+            for token in normalized.split():
+                start, end = self._prefix_range(self.token_keys, token)
+                ids = set()
+                for key in self.token_keys[start:end]:
+                    ids |= self.tokens[key]
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    break
+            for i in sorted(matches or (), key=lambda i: self.tasks[i]["title"]):
+                if len(found) >= limit:
+                    break
+                add(i)
+        if not found:
+            lookup = {title: i for title, i in reversed(self.titles)}
+            for title in difflib.get_close_matches(normalized, list(lookup), n=limit, cutoff=0.5):
+                add(lookup[title])
+        return [self.tasks[i] for i in found[:limit]]
+
+task_index = TaskIndex()
+
+async def fetch_columns(columns: dict, limit: int = 3, timeout: float = 15) -> dict:
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def fetch(column_id):
+        async with semaphore:
+            tasks = await asyncio.wait_for(get_tasks_from_yougile(column_id, config.get("yougile_page_limit", 1000)), timeout)
+            if tasks is None:
+                raise RuntimeError(f"не удалось получить задачи колонки {column_id}")
+            return tasks
+
+    results = await asyncio.gather(*(fetch(column_id) for column_id in columns.values()), return_exceptions=True)
+    return dict(zip(columns, results))
 
 def format_tasks_for_message(tasks, column_name):
     if not tasks:
@@ -144,13 +753,90 @@ def format_tasks_for_message(tasks, column_name):
         lines.append(line)
     return "\n".join(lines)
 
+def get_board_message_ids() -> list:
+    if config.get("message_ids"):
+        return [int(message_id) for message_id in config["message_ids"]]
+    if config.get("message_id"):
+        return [int(config["message_id"])]
+    return []
+
+def paginate_task_board(sections: list, reserve: int = 0) -> list:
+    limit = EMBED_DESCRIPTION_LIMIT - reserve
+    descriptions = []
+    current = []
+    size = 0
+    for column_name, formatted in sections:
+        header = f"## {column_name}"
+        lines = [header] + formatted.split("\n")
+        for k, line in enumerate(lines):
+            if len(line) > limit:
+                line = line[:limit - 1] + "…"
+            if current and size + 1 + len(line) > limit:
+                descriptions.append("\n".join(current))
+                current, size = [], 0
+                if k > 0:
+                    continuation = f"## {column_name} (продолжение)"
+                    current, size = [continuation], len(continuation)
+                    if size + 1 + len(line) > limit:
+                        line = line[:limit - size - 2] + "…"
+            current.append(line)
+            size += len(line) + (1 if size else 0)
+    if current:
+        descriptions.append("\n".join(current))
+    pages = []
+    page, page_size = [], len("Список задач")
+    for description in descriptions:
+        if page and (len(page) >= MESSAGE_EMBEDS or page_size + len(description) > MESSAGE_EMBED_CHARS - reserve):
+            pages.append(page)
+            page, page_size = [], 0
+        page.append(description)
+        page_size += len(description)
+    if page:
+        pages.append(page)
+    return pages or [["Задач нет."]]
+
 async def send_task_message(interaction: discord.Interaction = None):
 #    global free_column_tasks, cached_tasks
     global cached_tasks
 #    free_column_tasks = []
     cached_tasks = []
+    sections = []
+    all_tasks = []
+    column_hashes = {}
+    column_results = await fetch_columns(
+        config['column_ids'],
+        config.get("yougile_concurrency", 3),
+        config.get("yougile_column_timeout", 15)
+    )
+    for column_name, column_tasks in column_results.items():
+        column_id = config['column_ids'][column_name]
+        if isinstance(column_tasks, BaseException):
+            logging.error(f"Ошибка при получении задач из колонки '{column_name}': {column_tasks!r}")
+            if interaction:
+                await send_embed_reply(interaction, "c", f"Ошибка при получении задач из '{column_name}'.", ephemeral=True, use_followup=True)
+        else:
+            changes = task_store.apply(column_id, column_tasks)
+            if any(changes.values()):
+                logging.info(f"Колонка '{column_name}': добавлено {len(changes['added'])}, изменено {len(changes['updated'])}, удалено {len(changes['removed'])}")
+        column_tasks = task_store.column_tasks(column_id)
+#       if column_name == "Свободные":
+#            free_column_tasks = column_tasks
+        all_tasks.extend(column_tasks)
+        formatted = format_tasks_for_message(column_tasks, column_name)
+        sections.append((column_name, formatted))
+        column_hashes[column_name] = hashlib.sha256(formatted.encode("utf-8")).hexdigest()
+    cached_tasks = all_tasks
+    task_index.rebuild(all_tasks)
+    board_hash = hashlib.sha256("\n".join(f"{name}:{digest}" for name, digest in column_hashes.items()).encode("utf-8")).hexdigest()
+    if interaction is None and board_hash == task_board_state["hash"] and get_board_message_ids():
+        task_board_state["skipped"] += 1
+        logging.info(f"Список задач не изменился, обновление пропущено (пропущено: {task_board_state['skipped']}, изменено: {task_board_state['edited']}).")
+        return
+    changed_columns = [name for name, digest in column_hashes.items() if task_board_state["column_hashes"].get(name) != digest]
+    if changed_columns:
+        logging.info(f"Изменились колонки: {', '.join(changed_columns)}")
     try:
-        channel = await bot.fetch_channel(config['channel_id'])
+        channel = await channel_resolver.get(config['channel_id'])
         if not channel:
             logging.error("Канал с указанным ID не найден.")
             if interaction:
@@ -161,67 +847,77 @@ async def send_task_message(interaction: discord.Interaction = None):
         if interaction:
             await send_embed_reply(interaction, "c", "Ошибка при получении канала.", ephemeral=True, use_followup=True)
         return
-    tasks_text = []
-    all_tasks = []
-    for column_name, column_id in config['column_ids'].items():
-        try:
-            column_tasks = await get_tasks_from_yougile(column_id)
-        except Exception as e:
-            logging.error(f"Ошибка при получении задач из колонки '{column_name}': {e}")
-            if interaction:
-                await send_embed_reply(interaction, "c", f"Ошибка при получении задач из '{column_name}'.", ephemeral=True, use_followup=True)
-            column_tasks = []
-#       if column_name == "Свободные":
-#            free_column_tasks = column_tasks
-        all_tasks.extend(column_tasks)
-        formatted = format_tasks_for_message(column_tasks, column_name)
-        tasks_text.append(f"## {column_name}\n{formatted}")
-    cached_tasks = all_tasks
     now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    message = (
-        "\n".join(tasks_text) +
+    footer = (
         f"\n-# Дата изменения: {now}"
         f"\n-# (Время из Германии, Москва ≈ +3 часа)"
     )
-    embed = discord.Embed(title="Список задач", description=message, color=0xffc86e)
-    try:
-        if config.get("message_id"):
-            old_msg = await channel.fetch_message(config["message_id"])
-            if old_msg and old_msg.author == bot.user:
-                await old_msg.edit(embed=embed)
-                logging.info("Сообщение с задачами обновлено.")
+    pages = paginate_task_board(sections, len(footer))
+    page_hashes = [hashlib.sha256(("\x00".join(page) + ("\x01" if i == len(pages) - 1 else "")).encode("utf-8")).hexdigest() for i, page in enumerate(pages)]
+    old_ids = get_board_message_ids()
+    old_hashes = task_board_state["page_hashes"]
+    new_ids = []
+    edited = 0
+    resend = False
+    for i, page in enumerate(pages):
+        is_last = i == len(pages) - 1
+        embeds = []
+        for j, description in enumerate(page):
+            if is_last and j == len(page) - 1:
+                description += footer
+            embeds.append(discord.Embed(title="Список задач" if i == 0 and j == 0 else None, description=description, color=0xffc86e))
+        message_id = old_ids[i] if i < len(old_ids) and not resend else None
+        if message_id and not is_last and interaction is None and i < len(old_hashes) and old_hashes[i] == page_hashes[i]:
+            new_ids.append(message_id)
+            continue
+        if message_id:
+            try:
+                await channel.get_partial_message(message_id).edit(embeds=embeds)
+                new_ids.append(message_id)
+                edited += 1
+                continue
+            except Exception as e:
+                logging.warning(f"Не удалось редактировать старое сообщение: {e}")
                 if interaction:
-                    await send_embed_reply(interaction, "a", "Сообщение с задачами отправлено/обновлено.", ephemeral=True, use_followup=True)
-                return
-    except Exception as e:
-        logging.warning(f"Не удалось редактировать старое сообщение: {e}")
-        if interaction:
-            await send_embed_reply(interaction, "b", f"Не удалось отредактировать старое сообщение.", ephemeral=True, use_followup=True)
-    sent_message = await channel.send(embed=embed)
-    config["message_id"] = sent_message.id
-    if config.get("auto_pin"):
+                    await send_embed_reply(interaction, "b", f"Не удалось отредактировать старое сообщение.", ephemeral=True, use_followup=True)
+        sent_message = await channel.send(embeds=embeds)
+        new_ids.append(sent_message.id)
+        edited += 1
+        resend = True
+        if config.get("auto_pin"):
+            try:
+                await sent_message.pin()
+                logging.info("Сообщение закреплено.")
+            except discord.Forbidden:
+                logging.warning("Не удалось закрепить сообщение — недостаточно прав.")
+                if interaction:
+                        await send_embed_reply(interaction, "b", "Не удалось закрепить список задач.", ephemeral=True, use_followup=True)
+    for message_id in old_ids:
+        if message_id in new_ids:
+            continue
         try:
-            await sent_message.pin()
-            logging.info("Сообщение закреплено.")
-        except discord.Forbidden:
-            logging.warning("Не удалось закрепить сообщение — недостаточно прав.")
-            if interaction:
-                    await send_embed_reply(interaction, "b", "Не удалось закрепить список задач.", ephemeral=True, use_followup=True)
-    save_config(config)
+            await channel.get_partial_message(message_id).delete()
+        except Exception as e:
+            logging.warning(f"Не удалось удалить устаревшую страницу списка задач: {e}")
+    task_board_state.update(hash=board_hash, column_hashes=column_hashes, page_hashes=page_hashes, edited=task_board_state["edited"] + edited)
+    logging.info(f"Список задач обновлён: страниц {len(pages)}, изменено {edited} (пропущено: {task_board_state['skipped']}, изменено всего: {task_board_state['edited']}).")
+    if interaction:
+        await send_embed_reply(interaction, "a", "Сообщение с задачами отправлено/обновлено.", ephemeral=True, use_followup=True)
+    if new_ids != old_ids or "message_id" in config:
+        config["message_ids"] = new_ids
+        config.pop("message_id", None)
+        save_config(config)
 
 async def send_leaderboard(interaction: discord.Interaction = None):
     try:
-        channel = await bot.fetch_channel(config['channel_id'])
+        channel = await channel_resolver.get(config['channel_id'])
     except Exception as e:
         logging.error(f"Ошибка при получении канала: {e}")
         if interaction:
             await send_embed_reply(interaction, "c", "Ошибка при получении канала.", ephemeral=True, use_followup=True)
         return
     try:
-        sh = gc.open_by_key(config['leaderboard_sheet_id'])
-        ws = sh.worksheet('Райтер месяца')
-        data = ws.get_all_values()
-        rows = data
+        rows = await sheets.get_all_values('Райтер месяца')
     except Exception as e:
         logging.error(f"Ошибка при получении данных из Google Sheets: {e}")
         if interaction:
@@ -242,13 +938,11 @@ async def send_leaderboard(interaction: discord.Interaction = None):
     embed = discord.Embed(title="Лидерборд", description=desc, color=0xffc86e)
     try:
         if config.get('leaderboard_message_id'):
-            msg = await channel.fetch_message(config['leaderboard_message_id'])
-            if msg and msg.author == bot.user:
-                await msg.edit(embed=embed)
-                logging.info("Лидерборд обновлён.")
-                if interaction:
-                    await send_embed_reply(interaction, "a", "Лидерборд отправлен/обновлен.", ephemeral=True, use_followup=True)
-                return
+            await channel.get_partial_message(config['leaderboard_message_id']).edit(embed=embed)
+            logging.info("Лидерборд обновлён.")
+            if interaction:
+                await send_embed_reply(interaction, "a", "Лидерборд отправлен/обновлен.", ephemeral=True, use_followup=True)
+            return
     except Exception as e:
         logging.warning(f"Не удалось обновить старое сообщение лидерборда: {e}")
         if interaction:
@@ -264,30 +958,107 @@ async def send_leaderboard(interaction: discord.Interaction = None):
                 await send_embed_reply(interaction, "b", "Не удалось закрепить лидерборд.", ephemeral=True, use_followup=True)
     save_config(config)
 
-async def run_monthly_event():
+def compute_monthly_settlement(writer_rows: list, general_rows: list, gambling_rows: list) -> dict:
+    best_nick, best_score = None, -1
+    scores = {}
+    for row in writer_rows:
+        if len(row) >= 2:
+            try:
+                score = int(row[1])
+            except ValueError:
+                continue
+            nick = row[0].strip()
+            scores[nick] = score
+            if score > best_score:
+                best_score = score
+                best_nick = nick
+    if best_nick is not None:
+        scores[best_nick] = best_score
+
+    gambling_index = build_nick_index(gambling_rows)
+    updates = []
+    missing = []
+    for nick, score in scores.items():
+        delta = score * 1000 * (2 if nick == best_nick else 1)
+        if delta == 0 or (nick == best_nick and delta < 0):
+            continue
+        entry = gambling_index.get(nick)
+        if entry is None:
+            missing.append(nick)
+            continue
+        row_idx, current = entry
+        updates.append({"nick": nick, "row": row_idx, "old": current, "delta": delta, "new": current + delta})
+
+    new_writer_rows = [
+        [row[0].strip(), "0"]
+        for row in general_rows[1:]
+        if len(row) >= 4 and row[3].strip().lower() == "true"
+    ]
+    return {
+        "best_nick": best_nick,
+        "best_score": best_score,
+        "gambling_updates": updates,
+        "missing": missing,
+        "writer_rows": new_writer_rows,
+        "old_writer_rows": writer_rows,
+    }
+
+def format_settlement(settlement: dict) -> str:
+    lines = [f"Победитель: {settlement['best_nick']} ({settlement['best_score']})"]
+    for update in settlement["gambling_updates"]:
+        lines.append(f"- {update['nick']}: +{update['delta']} ({update['old']} → {update['new']})")
+    if settlement["missing"]:
+        lines.append("Нет в 'Gambling': " + ", ".join(settlement["missing"]))
+    lines.append(f"Новый лист 'Райтер месяца': {len(settlement['writer_rows'])} строк")
+    return "\n".join(lines)
+
+async def commit_monthly_settlement(settlement: dict):
+    await sheets.flush("Gambling")
+    gambling_index = (await sheets.snapshot("Gambling", fresh=True))["index"]
+    for update in settlement["gambling_updates"]:
+        entry = gambling_index.get(update["nick"])
+        if entry is None:
+            logging.warning(f"Игрок {update['nick']} пропал из 'Gambling' во время расчёта ивента.")
+            continue
+        update["row"], update["old"] = entry
+        update["new"] = update["old"] + update["delta"]
+        sheets.queue_cell("Gambling", update["row"], 2, str(update["new"]))
+    old_rows = settlement["old_writer_rows"]
+    new_rows = settlement["writer_rows"]
+    height = max(len(old_rows), len(new_rows))
+    width = max([2] + [len(row) for row in old_rows])
+    if height:
+        grid = []
+        for i in range(height):
+            row = new_rows[i] if i < len(new_rows) else []
+            grid.append(row + [""] * (width - len(row)))
+        await sheets.ensure_rows("Райтер месяца", height)
+        await sheets.batch_write([("Райтер месяца", f"A1:{rowcol_to_a1(height, width)}", grid)])
+    else:
+        await sheets.flush("Gambling")
+
+async def run_monthly_event(dry_run: bool = False):
     try:
-        sh = gc.open_by_key(config['leaderboard_sheet_id'])
-        ws_writer = sh.worksheet("Райтер месяца")
-        ws_general = sh.worksheet("General")
-        ws_gambling = sh.worksheet("Gambling")
-        rows = ws_writer.get_all_values()
-
-        best_nick, best_score = None, -1
-        for row in rows:
-            if len(row) >= 2:
-                try:
-                    score = int(row[1])
-                    if score > best_score:
-                        best_score = score
-                        best_nick = row[0].strip()
-                except:
-                    continue
+        rows, gen_rows, gambling_rows = await asyncio.gather(
+            sheets.get_all_values("Райтер месяца", fresh=True),
+            sheets.get_all_values("General", fresh=True),
+            sheets.get_all_values("Gambling", fresh=True),
+        )
+        settlement = compute_monthly_settlement(rows, gen_rows, gambling_rows)
+        best_nick, best_score = settlement["best_nick"], settlement["best_score"]
 
         if not best_nick:
             logging.warning("Нет победителя для ивента.")
-            return
+            return None
+
+        if dry_run:
+            logging.info(f"Пробный расчёт ивента Райтер месяца:\n{format_settlement(settlement)}")
+            return settlement
 
-        channel = await bot.fetch_channel(config['channel_id'])
+        await commit_monthly_settlement(settlement)
+        logging.info(f"Расчёт ивента Райтер месяца:\n{format_settlement(settlement)}")
+
+        channel = await channel_resolver.get(config['channel_id'])
         guild = channel.guild
         member = discord.utils.find(lambda m: m.name == best_nick, guild.members)
         if member:
@@ -320,7 +1091,7 @@ async def run_monthly_event():
             ),
             color=0xffc86e
         )
-        alt_channel = await bot.fetch_channel(config["monthly_announce_channel_id"])
+        alt_channel = await channel_resolver.get(config["monthly_announce_channel_id"])
         if alt_channel:
             await alt_channel.send(embed=alt_embed)
         new_member = discord.utils.find(lambda m: m.name == best_nick, guild.members)
@@ -328,7 +1099,7 @@ async def run_monthly_event():
             logging.warning(f"Не удалось найти пользователя с ником: {best_nick}")
         else:
             role = guild.get_role(int(config['monthly_winner_role_id']))
-            prev_id = int(config.get('monthly_winner_user_id'))
+            prev_id = int(config.get('monthly_winner_user_id') or 0)
             if prev_id:
                 old = guild.get_member(prev_id)
                 if old and role in old.roles:
@@ -336,69 +1107,148 @@ async def run_monthly_event():
             await new_member.add_roles(role, reason="Победа в ивенте месяца")
             config['monthly_winner_user_id'] = str(new_member.id)
             save_config(config)
-        ws_writer.clear()
-        gen_rows = ws_general.get_all_values()
-        for row in gen_rows[1:]:
-            if len(row) >= 4 and row[3].strip().lower() == "true":
-                ws_writer.append_row([row[0].strip(), "0"])
-        gambling_rows = ws_gambling.get_all_values()
-        gambling_dict = {}
-        for row in gambling_rows:
-            if len(row) >= 2:
-                gambling_dict[row[0].strip()] = int(row[1])
-        winner_points = best_score * 1000 * 2
-        if winner_points > 0:
-            for i, row in enumerate(gambling_rows):
-                if len(row) >= 1 and row[0].strip() == best_nick:
-                    try:
-                        current_points = int(row[1])
-                    except:
-                        current_points = 0
-                    new_points = current_points + winner_points
-                    ws_gambling.update_cell(i + 1, 2, str(new_points))
-                    break
-
-        for row in rows:
-            if len(row) >= 2:
-                try:
-                    nick = row[0].strip()
-                    score = int(row[1])
-                except:
-                    continue
-
-                if nick == best_nick:
-                    continue
-
-                for i, g_row in enumerate(gambling_rows):
-                    if len(g_row) >= 1 and g_row[0].strip() == nick:
-                        try:
-                            current_points = int(g_row[1])
-                        except:
-                            current_points = 0
-                        new_points = current_points + score * 1000
-                        ws_gambling.update_cell(i + 1, 2, str(new_points))
-                        break
         logging.info(f"Ивент Райтер месяца завершён: победитель — {best_nick}")
+        return settlement
     except Exception as e:
         logging.error(f"Ошибка в ивенте Райтер месяца: {e}")
+        return None
+
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+TRAILING_SPACES_RE = re.compile(r"[ \t]+\n")
+INLINE_SPACES_RE = re.compile(r"[ \t\r\n]+")
+LEADING_SPACES_RE = re.compile(r"(?m)^[ \t]+(?=[^\s\-\d])")
+CODE_BLOCK_RE = re.compile(r"(\n```\n.*?\n```\n)", re.S)
+INLINE_TAGS = {
+    "strong": "**", "b": "**",
+    "em": "*", "i": "*",
+    "u": "__",
+    "s": "~~", "strike": "~~", "del": "~~",
+    "code": "`",
+}
+HEADING_TAGS = {"h1": "# ", "h2": "## ", "h3": "### ", "h4": "### ", "h5": "### ", "h6": "### "}
+BLOCK_TAGS = {"p", "div", "blockquote", "pre"}
+
+class DiscordMarkdownParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.lists = []
+        self.links = []
+        self.pre = 0
+        self.quote = 0
+
+    def write(self, text: str):
+        if self.links:
+            self.links[-1][1].append(text)
+        else:
+            self.out.append(text)
 
-def html_to_discord(text):
-    replacements = [
-        ("<strong>", "**"), ("</strong>", "**"),
-        ("<em>", "*"), ("</em>", "*"),
-        ("<p>", ""), ("</p>", "\n\n"),
-        ("<br>", "\n"),
-        ("&nbsp;", " "),
-    ]
-    for old, new in replacements:
-        text = text.replace(old, new)
+    def newline(self):
+        self.write("\n" + "> " * self.quote)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "code" and self.pre:
+            return
+        if tag in INLINE_TAGS:
+            self.write(INLINE_TAGS[tag])
+        elif tag in HEADING_TAGS:
+            self.newline()
+            self.write(HEADING_TAGS[tag])
+        elif tag == "br":
+            self.newline()
+        elif tag in ("ul", "ol"):
+            self.lists.append([tag, 0])
+        elif tag == "li":
+            self.newline()
+            if self.lists:
+                kind = self.lists[-1]
+                kind[1] += 1
+                marker = f"{kind[1]}. " if kind[0] == "ol" else "- "
+            else:
+                marker = "- "
+            self.write("  " * max(len(self.lists) - 1, 0) + marker)
+        elif tag == "a":
+            self.links.append((dict(attrs).get("href"), []))
+        elif tag == "blockquote":
+            self.quote += 1
+            self.newline()
+        elif tag == "pre":
+            self.pre += 1
+            self.write("\n```\n")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "code" and self.pre:
+            return
+        if tag in INLINE_TAGS:
+            self.write(INLINE_TAGS[tag])
+        elif tag in HEADING_TAGS:
+            self.newline()
+        elif tag in ("ul", "ol"):
+            if self.lists:
+                self.lists.pop()
+            if not self.lists:
+                self.newline()
+                self.newline()
+        elif tag == "a" and self.links:
+            href, parts = self.links.pop()
+            label = "".join(parts).strip()
+            if href and label and label != href:
+                self.write(f"[{label}]({href})")
+            else:
+                self.write(href or label)
+        elif tag == "blockquote":
+            self.quote = max(self.quote - 1, 0)
+            self.newline()
+        elif tag == "pre":
+            self.pre = max(self.pre - 1, 0)
+            self.write("\n```\n")
+        elif tag in BLOCK_TAGS:
+            self.newline()
+            self.newline()
+
+    def handle_data(self, data):
+        data = data.replace("\xa0", " ")
+        if not self.pre:
+            data = INLINE_SPACES_RE.sub(" ", data)
+        self.write(data)
+
+    def result(self) -> str:
+        self.close()
+        while self.links:
+            href, parts = self.links.pop()
+            self.out.append("".join(parts))
+        parts = CODE_BLOCK_RE.split("".join(self.out))
+        for i in range(0, len(parts), 2):
+            text = TRAILING_SPACES_RE.sub("\n", parts[i])
+            text = LEADING_SPACES_RE.sub("", text)
+            text = BLANK_LINES_RE.sub("\n\n", text)
+            if i + 1 < len(parts):
+                text = text.rstrip("\n") + "\n"
+            parts[i] = text
+        return "".join(parts).strip()
 
-    text = re.sub(r"<ul>|<ol>", "", text)
-    text = re.sub(r"</ul>|</ol>", "", text)
-    text = re.sub(r"<li>", "- ", text)
-    text = re.sub(r"</li>", "\n", text)
-    text = re.sub(r"<.*?>", "", text)
-    return text.strip()
+def html_to_discord(text):
+    parser = DiscordMarkdownParser()
+    parser.feed(text or "")
+    return parser.result()
+
+description_cache = OrderedDict()
+
+def render_task_description(task: dict) -> str:
+    raw = task.get("description") or "Нет описания."
+    key = (task.get("id"), hashlib.sha256(raw.encode("utf-8")).hexdigest())
+    rendered = description_cache.get(key)
+    if rendered is None:
+        rendered = html_to_discord(raw)
+        description_cache[key] = rendered
+        if len(description_cache) > 512:
+            description_cache.popitem(last=False)
+    else:
+        description_cache.move_to_end(key)
+    return rendered
 
 def is_image_attachment(att: discord.Attachment) -> bool:
     if att.content_type:
@@ -466,8 +1316,127 @@ def get_text_color_from_background(bg_color):
 def angle_mod(angle):
     return angle % 360
 
-async def query_openrouter(prompt: str) -> str | None:
-    url = "https://openrouter.ai/api/v1/chat/completions"
+def parse_retry_after(value) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class RequestScheduler:
+    def __init__(
+        self,
+        rate_per_minute: float = 20,
+        burst: int = 3,
+        max_pending: int = 10,
+        deadline: float = 10,
+        max_retries: int = 2,
+        backoff: float = 1.0,
+        max_backoff: float = 60,
+        timeout: float = 20
+    ):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.pending = 0
+        self.lock = None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def expected_wait(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        deficit = self.pending + 1 - self.tokens
+        return max(0.0, self.blocked_until - now) + max(0.0, deficit) / self.rate
+
+    async def acquire(self, deadline_at: float) -> bool:
+        if self.pending >= self.max_pending:
+            logging.warning(f"[AI] Очередь запросов заполнена ({self.pending}), используем ключи.")
+            return False
+        wait = self.expected_wait()
+        if time.monotonic() + wait > deadline_at:
+            logging.warning(f"[AI] Ожидание в очереди ~{wait:.1f} с превышает дедлайн, используем ключи.")
+            return False
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        self.pending += 1
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.blocked_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                    if now + delay > deadline_at:
+                        return False
+                    await asyncio.sleep(delay)
+        finally:
+            self.pending -= 1
+
+    def penalize(self, retry_after: Optional[float] = None) -> float:
+        self.failures += 1
+        if retry_after is None:
+            retry_after = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        return retry_after
+
+    def succeed(self):
+        self.failures = 0
+
+    async def send(self, method: str, url: str, **kwargs) -> Optional[bytes]:
+        deadline_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            if not await self.acquire(deadline_at):
+                return None
+            try:
+                status, headers, body = await http_client.request(method, url, timeout=self.timeout, **kwargs)
+            except Exception as e:
+                delay = self.penalize()
+                logging.error(f"Exception while calling OpenRouter: {e!r} (повтор через {delay:.1f} с)")
+                continue
+            if status == 200:
+                self.succeed()
+                return body
+            if status == 429 or status >= 500:
+                delay = self.penalize(parse_retry_after(headers.get("Retry-After")))
+                logging.warning(f"OpenRouter API {status}, попытка {attempt + 1}, пауза {delay:.1f} с.")
+                continue
+            logging.warning(f"OpenRouter API error {status}: {body.decode('utf-8', errors='replace')}")
+            return None
+        return None
+
+openrouter_scheduler = RequestScheduler(
+    config.get("ai_rate_per_minute", 20),
+    config.get("ai_burst", 3),
+    config.get("ai_queue_size", 10),
+    config.get("ai_deadline", 10),
+    config.get("ai_max_retries", 2),
+    config.get("ai_backoff", 1.0),
+    config.get("ai_max_backoff", 60),
+    config.get("ai_timeout", 20)
+)
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+def build_openrouter_request(prompt: str) -> tuple:
     headers = {
         "Authorization": f"Bearer {os.getenv('AI_API_TOKEN')}",
         "Content-Type": "application/json"
@@ -493,20 +1462,251 @@ async def query_openrouter(prompt: str) -> str | None:
         "temperature": 1.0,
         "max_tokens": 256
     }
+    return headers, payload
+
+async def query_openrouter(prompt: str) -> str | None:
+    headers, payload = build_openrouter_request(prompt)
+    body = await openrouter_scheduler.send("POST", OPENROUTER_URL, headers=headers, json=payload)
+    if body is None:
+        return None
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-                elif resp.status == 429:
-                    logging.warning("OpenRouter API rate limit exceeded (429).")
-                else:
-                    logging.warning(f"OpenRouter API error {resp.status}: {await resp.text()}")
+        data = decode_json(body) or {}
+        return data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
     except Exception as e:
-        logging.error(f"Exception while calling OpenRouter: {e}")
+        logging.error(f"Exception while parsing OpenRouter response: {e}")
     return None
 
+async def stream_openrouter(prompt: str):
+    headers, payload = build_openrouter_request(prompt)
+    payload["stream"] = True
+    scheduler = openrouter_scheduler
+    if not await scheduler.acquire(time.monotonic() + scheduler.deadline):
+        return
+    session = await http_client.start()
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=scheduler.timeout.total)
+    async with session.post(OPENROUTER_URL, headers=headers, json=payload, timeout=timeout) as response:
+        if response.status != 200:
+            body = await response.read()
+            if response.status == 429 or response.status >= 500:
+                scheduler.penalize(parse_retry_after(response.headers.get("Retry-After")))
+            logging.warning(f"OpenRouter API error {response.status}: {body.decode('utf-8', errors='replace')}")
+            return
+        scheduler.succeed()
+        async for raw in response.content:
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+async def stream_reply(message: discord.Message, prompt: str, state: dict) -> str | None:
+    interval = config.get("ai_stream_edit_interval", 1.0)
+    text = ""
+    shown = ""
+    last_edit = 0.0
+    try:
+        async for delta in stream_openrouter(prompt):
+            text += delta
+            if not text.strip() or time.monotonic() - last_edit < interval:
+                continue
+            shown = sanitize_mentions(text.strip(), message.guild)[:2000]
+            if state["message"] is None:
+                state["message"] = await message.reply(shown)
+            else:
+                await state["message"].edit(content=shown)
+            last_edit = time.monotonic()
+    except Exception as e:
+        logging.error(f"Exception while streaming OpenRouter: {e!r}")
+        if state["message"] is not None:
+            try:
+                await state["message"].edit(content=f"{shown}…")
+            except discord.HTTPException:
+                pass
+        return None
+    text = text.strip()
+    if not text:
+        return None
+    final = sanitize_mentions(text, message.guild)[:2000]
+    if state["message"] is None:
+        state["message"] = await message.reply(final)
+    elif final != shown:
+        await state["message"].edit(content=final)
+    return text
+
+def normalize_prompt(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class AnswerCache:
+    def __init__(self, ttl: float = 600, max_size: int = 256, report_every: int = 100):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.report_every = report_every
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def fetch(self, key: str, factory):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            self.report()
+            return value
+        task = self.inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        self.report()
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self.inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if task.result():
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
+
+    def report(self):
+        stats = self.stats()
+        if stats["lookups"] % self.report_every == 0:
+            logging.info(
+                f"[AI cache] запросов: {stats['lookups']}, попаданий: {stats['hits']}, "
+                f"объединено: {stats['coalesced']}, промахов: {stats['misses']}, "
+                f"hit rate: {stats['hit_rate']:.0%}, записей: {stats['size']}"
+            )
+
+answer_cache = AnswerCache(
+    config.get("ai_cache_ttl", 600),
+    config.get("ai_cache_size", 256)
+)
+
+class SpamGuard:
+    def __init__(
+        self,
+        user_limit: int = 4,
+        user_window: float = 10,
+        channel_limit: int = 10,
+        channel_window: float = 10,
+        cooldown: float = 60,
+        max_users: int = 1000,
+        idle_ttl: float = 600
+    ):
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.channel_limit = channel_limit
+        self.channel_window = channel_window
+        self.cooldown = cooldown
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.users = OrderedDict()
+        self.channels = {}
+        self.blocked = {}
+        self.allowed = 0
+        self.rejected = {"user": 0, "channel": 0, "cooldown": 0}
+
+    def _take(self, events: deque, limit: int, window: float, now: float) -> bool:
+        while events and now - events[0] > window:
+            events.popleft()
+        if len(events) >= limit:
+            return False
+        events.append(now)
+        return True
+
+    def _evict(self, now: float):
+        while self.users:
+            user_id, events = next(iter(self.users.items()))
+            if len(self.users) <= self.max_users and events and now - events[-1] <= self.idle_ttl:
+                break
+            del self.users[user_id]
+        if len(self.blocked) > self.max_users:
+            self.blocked = {user_id: until for user_id, until in self.blocked.items() if until > now}
+
+    def allow(self, user_id: int, channel_id: int) -> bool:
+        now = time.monotonic()
+        self._evict(now)
+        until = self.blocked.get(user_id)
+        if until is not None:
+            if now < until:
+                self.rejected["cooldown"] += 1
+                return False
+            del self.blocked[user_id]
+        events = self.users.get(user_id)
+        if events is None:
+            events = self.users[user_id] = deque(maxlen=self.user_limit)
+        self.users.move_to_end(user_id)
+        if not self._take(events, self.user_limit, self.user_window, now):
+            self.blocked[user_id] = now + self.cooldown
+            events.clear()
+            self.rejected["user"] += 1
+            logging.warning(f"[SPAM] Упоминания от {user_id} игнорируются {self.cooldown:.0f} с. {self.stats()}")
+            return False
+        channel_events = self.channels.setdefault(channel_id, deque(maxlen=self.channel_limit))
+        if not self._take(channel_events, self.channel_limit, self.channel_window, now):
+            self.rejected["channel"] += 1
+            logging.warning(f"[SPAM] Превышен лимит упоминаний в канале {channel_id}. {self.stats()}")
+            return False
+        self.allowed += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "tracked_users": len(self.users),
+            "blocked_users": len(self.blocked),
+        }
+
+spam_guard = SpamGuard(
+    config.get("spam_user_limit", 4),
+    config.get("spam_user_window", 10),
+    config.get("spam_channel_limit", 10),
+    config.get("spam_channel_window", 10),
+    config.get("spam_cooldown", 60),
+    config.get("spam_max_users", 1000),
+    config.get("spam_idle_ttl", 600)
+)
+
 @bot.tree.command(name="event-manager", description="Управление авто-событиями бота.", guild=discord.Object(id=config['guild_id']))
 @app_commands.describe(
     target="Выберите модуль: задачи, лидерборд или ивент",
@@ -522,6 +1722,7 @@ async def query_openrouter(prompt: str) -> str | None:
         app_commands.Choice(name="Отправить/обновить (один раз)", value="update"),
         app_commands.Choice(name="Запустить автообновление/автоивент", value="start"),
         app_commands.Choice(name="Остановить автообновление/автоивент", value="stop"),
+        app_commands.Choice(name="Пробный расчёт без записи (только ивент)", value="dry_run"),
     ]
 )
 async def event_manager(
@@ -540,6 +1741,7 @@ async def event_manager(
                 await send_embed_reply(interaction, message_type="b", content="Цикл уже запущен.", ephemeral=True, use_followup=True)
                 return
             if not update_task_message.is_running():
+                update_task_message.change_interval(minutes=config.get("task_update_interval_minutes", 60))
                 update_task_message.start()
             config["is_updating"] = True
             save_config(config)
@@ -594,13 +1796,25 @@ async def event_manager(
                 monthly_event_task.stop()
             await send_embed_reply(interaction, message_type="a", content="Автоивент выключен.", ephemeral=True, use_followup=True)
             logging.info(f"Автоивент 'Райтер месяца' остановлен.")
+        elif action.value == "dry_run":
+            settlement = await run_monthly_event(dry_run=True)
+            if not settlement:
+                await send_embed_reply(interaction, message_type="b", content="Не удалось рассчитать ивент.", ephemeral=True, use_followup=True)
+                return
+            summary = format_settlement(settlement)
+            if len(summary) > 3500:
+                summary = summary[:3500] + "\n…"
+            await send_embed_reply(interaction, message_type="a", content=summary, ephemeral=True, use_followup=True)
+            logging.info(f"Пробный расчёт 'Райтер месяца' запрошен пользователем {interaction.user}.")
+    if action.value == "dry_run" and target.value != "monthly_event":
+        await send_embed_reply(interaction, message_type="b", content="Пробный расчёт доступен только для ивента.", ephemeral=True, use_followup=True)
 
 @bot.tree.command(name="text-train", description="Отправить обучающий инструктаж", guild=discord.Object(id=config['guild_id']))
 async def text_train(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     await send_embed_reply(interaction, message_type="a", content="Отправка инструктажа...", ephemeral=True, use_followup=True)
     try:
-        channel = await bot.fetch_channel(config['channel_id'])
+        channel = await channel_resolver.get(config['channel_id'])
     except Exception as e:
         logging.error(f"Ошибка при получении канала: {e}")
         await send_embed_reply(interaction, message_type="c", content="Ошибка при получении канала инструктажа.", ephemeral=True, use_followup=True)
@@ -623,16 +1837,13 @@ async def text_train(interaction: discord.Interaction):
 async def task_desc(interaction: discord.Interaction, task_name: str):
     await interaction.response.defer(thinking=True)
 
-    all_tasks = cached_tasks.copy() if 'cached_tasks' in globals() else []
-
-    matched_task = next((task for task in all_tasks if task["title"].lower() == task_name.lower()), None)
+    matched_task = task_index.find(task_name)
 
     if not matched_task:
         await send_embed_reply(interaction, "c", "Задача не найдена во всех колонках.", ephemeral=True, use_followup=True)
         return
 
-    raw_desc = matched_task.get("description", "Нет описания.")
-    formatted_desc = html_to_discord(raw_desc)
+    formatted_desc = render_task_description(matched_task)
 
     stickers_text = ""
     stickers_data = matched_task.get("stickers", {})
@@ -663,6 +1874,13 @@ async def task_desc(interaction: discord.Interaction, task_name: str):
     )
     await interaction.followup.send(embed=embed)
 
+@task_desc.autocomplete("task_name")
+async def task_desc_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=task["title"][:100], value=task["title"][:100])
+        for task in task_index.search(current, 25)
+    ]
+
 @bot.tree.command(name="auto-pin", description="Включить/выключить автозакреп сообщений", guild=discord.Object(id=config['guild_id']))
 async def auto_pin(interaction: discord.Interaction):
     config["auto_pin"] = not config.get("auto_pin", False)
@@ -670,42 +1888,171 @@ async def auto_pin(interaction: discord.Interaction):
     status = "включен" if config["auto_pin"] else "выключен"
     await send_embed_reply(interaction, message_type="a", content=f"Автозакреп теперь {status}.", ephemeral=True, use_followup=False)
 
+@bot.tree.command(name="content-reload", description="Перечитать файлы контента (переводы, ответы, флаги, инструктаж)", guild=discord.Object(id=config['guild_id']))
+@app_commands.default_permissions(administrator=True)
+async def content_reload(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        content = await asyncio.to_thread(load_content)
+    except Exception as e:
+        logging.error(f"Ошибка при перезагрузке контента: {e}")
+        await send_embed_reply(interaction, "c", f"Не удалось перечитать контент: {e}", ephemeral=True, use_followup=True)
+        return
+    apply_content(content)
+    summary = ", ".join(f"{key}: {len(value)}" for key, value in content.items())
+    logging.info(f"Контент перезагружен пользователем {interaction.user} ({summary})")
+    await send_embed_reply(interaction, "a", f"Контент перезагружен ({summary}).", ephemeral=True, use_followup=True)
+
 @bot.tree.command(name="translate", description="Перевод между русским и тугосеринским", guild=discord.Object(id=config['guild_id']))
 @app_commands.describe(
     direction="Направление перевода",
-    text="Текст для перевода"
+    text="Текст для перевода",
+    file="Файл .txt или .md для перевода целиком"
 )
 @app_commands.choices(direction=[
     app_commands.Choice(name="С русского", value="ru_to_tuga"),
     app_commands.Choice(name="С тугосеринского", value="tuga_to_ru")
 ])
-async def translate(interaction: discord.Interaction, direction: app_commands.Choice[str], text: str):
-    translations = config.get("translations", {})
-    result = []
+async def translate(
+    interaction: discord.Interaction,
+    direction: app_commands.Choice[str],
+    text: Optional[str] = None,
+    file: Optional[discord.Attachment] = None
+):
+    if file is not None:
+        await translate_attachment(interaction, direction.value, file)
+        return
+    if not text:
+        await send_embed_reply(interaction, "b", "Укажите текст или прикрепите файл .txt/.md.", ephemeral=True, use_followup=False)
+        return
+    translated = translator.translate(text, direction.value)
+    await send_embed_reply(interaction, message_type="a", content=f"Перевод: `{translated}`", ephemeral=True, use_followup=False)
 
-    if direction.value == "tuga_to_ru":
-        reversed_translations = {v.lower(): k for k, v in translations.items()}
-        used_dict = reversed_translations
-    else:
-        used_dict = {k.lower(): v for k, v in translations.items()}
-
-    words = re.findall(r'\w+|\W+', text)
-
-    for word in words:
-        lower_word = word.lower()
-        replacement = used_dict.get(lower_word)
-        if replacement:
-            if word.istitle():
-                result.append(replacement.capitalize())
-            elif word.isupper():
-                result.append(replacement.upper())
-            else:
-                result.append(replacement)
-        else:
-            result.append(word)
+async def translate_attachment(interaction: discord.Interaction, direction: str, attachment: discord.Attachment):
+    stem, ext = os.path.splitext(attachment.filename)
+    if ext.lower() not in TRANSLATE_FILE_EXTENSIONS:
+        await send_embed_reply(interaction, "b", "Поддерживаются только файлы .txt и .md.", ephemeral=True, use_followup=False)
+        return
+    max_bytes = config.get("translate_file_max_bytes", TRANSLATE_FILE_MAX_BYTES)
+    if attachment.size > max_bytes:
+        await send_embed_reply(interaction, "b", f"Файл слишком большой (максимум {max_bytes // 1024} КБ).", ephemeral=True, use_followup=False)
+        return
 
-    translated = ''.join(result)
-    await send_embed_reply(interaction, message_type="a", content=f"Перевод: `{translated}`", ephemeral=True, use_followup=False)
+    await interaction.response.defer(ephemeral=True)
+    started = time.perf_counter()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    stream = translator.stream(direction, TRANSLATE_CHUNK_SIZE)
+    output = tempfile.SpooledTemporaryFile(max_size=TRANSLATE_SPOOL_SIZE)
+    received = 0
+    try:
+        session = await http_client.start()
+        async with session.get(attachment.url) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            async for chunk in response.content.iter_chunked(TRANSLATE_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise RuntimeError("размер файла превышает лимит")
+                output.write(stream.feed(decoder.decode(chunk)).encode("utf-8"))
+        output.write(stream.feed(decoder.decode(b"", final=True)).encode("utf-8"))
+        output.write(stream.finish().encode("utf-8"))
+        output.seek(0)
+        logging.info(
+            f"Файл {attachment.filename} ({received} байт) переведён ({direction}) "
+            f"за {time.perf_counter() - started:.2f} с по запросу {interaction.user}"
+        )
+        await interaction.followup.send(
+            content="Перевод готов.",
+            file=discord.File(output, filename=f"{stem}_{direction}{ext.lower()}"),
+            ephemeral=True
+        )
+    except Exception as e:
+        logging.error(f"Ошибка при переводе файла {attachment.filename}: {e}")
+        await send_embed_reply(interaction, "c", f"Не удалось перевести файл: {e}", ephemeral=True, use_followup=True)
+    finally:
+        output.close()
+
+GIF_RENDERER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gif_renderer.py")
+
+class GifJobQueue:
+    def __init__(self, workers: int = 2, max_jobs: int = 6, per_user: int = 1, timeout: float = 60):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.per_user = per_user
+        self.timeout = timeout
+        self.processes = set()
+        self.semaphore = None
+        self.users = {}
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, user_id: int, job: dict) -> tuple:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, GIF_RENDERER_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.processes.add(process)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(pickle.dumps(job)), self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Гифка пользователя {user_id} не отрисована за {self.timeout} с, процесс отрисовки остановлен.")
+            raise
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            self.processes.discard(process)
+        if process.returncode:
+            raise RuntimeError(f"Процесс отрисовки гифки завершился с кодом {process.returncode}: {stderr.decode(errors='replace')[-500:]}")
+        status, result = pickle.loads(stdout)
+        if status == "error":
+            raise GifRenderError(result)
+        return result
+
+    async def close(self):
+        for process in list(self.processes):
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        self.processes.clear()
+
+    async def submit(self, user_id: int, job: dict, on_queued=None) -> tuple:
+        if self.users.get(user_id, 0) >= self.per_user:
+            raise GifRenderError("У вас уже есть гифка в обработке. Дождитесь её завершения.")
+        if self.pending >= self.max_jobs:
+            raise GifRenderError("Очередь обработки гифок заполнена. Попробуйте позже.")
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.workers)
+        self.users[user_id] = self.users.get(user_id, 0) + 1
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            position = self.pending - self.workers
+            if position > 0 and on_queued:
+                await on_queued(position)
+            async with self.semaphore:
+                result = await self.run(user_id, job)
+            self.completed += 1
+            logging.info(f"Гифка отрисована за {time.perf_counter() - started:.2f} с (в очереди: {self.pending - 1}).")
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            self.users[user_id] -= 1
+            if not self.users[user_id]:
+                del self.users[user_id]
+
+gif_jobs = GifJobQueue(
+    config.get("gif_workers", min(2, os.cpu_count() or 1)),
+    config.get("gif_queue_size", 6),
+    config.get("gif_jobs_per_user", 1),
+    config.get("gif_job_timeout", 60)
+)
 
 @bot.tree.command(name="gif-create", description="Создание гифки из спрайт-листа. Обработка спрайтов с прозрачностью работает некорректно.", guild=discord.Object(id=config['guild_id']))
 @app_commands.choices(
@@ -775,9 +2122,20 @@ async def gif_create(
             logging.error(f"Ошибка при чтении meta.json: {e}")
             return
 
-    frames = []
     durations = []
     width = height = None
+    max_frame_side = config.get("gif_max_frame_side", 1024)
+    max_pixels = config.get("gif_max_sheet_pixels", 4096 * 4096)
+    max_upload = config.get("gif_max_upload_bytes", 8 * 1024 * 1024)
+    job = {
+        "order": read_order or "lr_tb",
+        "max_pixels": max_pixels,
+        "max_frames": config.get("gif_max_frames", 256),
+        "trim_durations": False,
+        "strict_durations": False,
+        "encoder": config.get("gif_encoder", "shared"),
+        "report_savings": config.get("gif_report_savings", False),
+    }
 
     try:
         if meta_data:
@@ -801,35 +2159,8 @@ async def gif_create(
                 await send_embed_reply(interaction, "c", f"В состоянии '{sprite_key}' отсутствуют как 'delays', так и 'directions'.", ephemeral=True, use_followup=True)
                 return
 
-            image_bytes = await sprite.read()
-            sprite_sheet = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-            sheet_width, sheet_height = sprite_sheet.size
-
-            cols = sheet_width // width
-            rows = sheet_height // height            
-
-            order = read_order or "lr_tb"
-
-            positions = []
-            if order == "lr_tb":
-                positions = [(row, col) for row in range(rows) for col in range(cols)]
-            elif order == "rl_bt":
-                positions = [(row, col) for row in reversed(range(rows)) for col in reversed(range(cols))]
-            elif order == "tb_lr":
-                positions = [(row, col) for col in range(cols) for row in range(rows)]
-            else:
-                positions = [(row, col) for row in range(rows) for col in range(cols)]
-
-            for row, col in positions:
-                left = col * width
-                upper = row * height
-                box = (left, upper, left + width, upper + height)
-                frame = sprite_sheet.crop(box)
-                if not is_frame_empty(frame):
-                    frames.append(frame)
-
-            if len(durations) > len(frames):
-                durations = durations[:len(frames)]
+            attachments = [sprite]
+            job.update(sheet=True, trim_durations=True)
 
         elif any([sprite_2, sprite_3, sprite_4, sprite_5, sprite_6, sprite_7, sprite_8, sprite_9, sprite_10]):
             attachments = [sprite] + [a for a in [
@@ -851,11 +2182,7 @@ async def gif_create(
                 await send_embed_reply(interaction, "c", f"Количество длительностей ({len(durations)}) не совпадает с количеством изображений ({len(attachments)}).", ephemeral=True, use_followup=True)
                 return
 
-            for att in attachments:
-                img_bytes = await att.read()
-                img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
-                if not is_frame_empty(img):
-                    frames.append(img)
+            job.update(sheet=False)
 
         else:
             if sprite_size is None:
@@ -868,76 +2195,53 @@ async def gif_create(
             else:
                 durations = None
 
-            image_bytes = await sprite.read()
-            sprite_sheet = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-            sheet_width, sheet_height = sprite_sheet.size
-            cols, rows = sheet_width // width, sheet_height // height
-
-            order = read_order or "lr_tb"
+            attachments = [sprite]
+            job.update(sheet=True, strict_durations=True)
 
-            positions = []
-            if order == "lr_tb":
-                positions = [(row, col) for row in range(rows) for col in range(cols)]
-            elif order == "rl_bt":
-                positions = [(row, col) for row in reversed(range(rows)) for col in reversed(range(cols))]
-            elif order == "tb_lr":
-                positions = [(row, col) for col in range(cols) for row in range(rows)]
-            else:
-                positions = [(row, col) for row in range(rows) for col in range(cols)]
+        if not (0 < width <= max_frame_side and 0 < height <= max_frame_side):
+            await send_embed_reply(interaction, "b", f"Размер кадра должен быть от 1 до {max_frame_side} пикселей по каждой стороне.", ephemeral=True, use_followup=True)
+            return
+        for att in attachments:
+            if att.size > max_upload or (att.width or 0) * (att.height or 0) > max_pixels:
+                await send_embed_reply(interaction, "b", f"Файл `{att.filename}` слишком большой для обработки.", ephemeral=True, use_followup=True)
+                return
 
-            for row, col in positions:
-                left = col * width
-                upper = row * height
-                box = (left, upper, left + width, upper + height)
-                frame = sprite_sheet.crop(box)
-                if not is_frame_empty(frame):
-                    frames.append(frame)
+        job.update(width=width, height=height, durations=durations, images=[await att.read() for att in attachments])
 
-            if durations is None:
-                durations = [600] * len(frames)
+    except Exception as e:
+        await send_embed_reply(interaction, "c", "Ошибка при обработке изображений или параметров.", ephemeral=True, use_followup=True)
+        logging.error(f"Ошибка при обработке: {e}")
+        return
 
-            if len(durations) != len(frames):
-                await send_embed_reply(interaction, "c", f"Количество длительностей ({len(durations)}) не совпадает с числом кадров ({len(frames)}).", ephemeral=True, use_followup=True)
-                return
+    async def report_position(position: int):
+        await send_embed_reply(interaction, "a", f"Гифка поставлена в очередь, позиция: {position}.", ephemeral=True, use_followup=True)
 
+    try:
+        data, stats = await gif_jobs.submit(interaction.user.id, job, report_position)
+    except GifRenderError as e:
+        await send_embed_reply(interaction, "c", str(e), ephemeral=True, use_followup=True)
+        return
+    except asyncio.TimeoutError:
+        await send_embed_reply(interaction, "c", "Обработка гифки заняла слишком много времени и была прервана.", ephemeral=True, use_followup=True)
+        return
     except Exception as e:
         await send_embed_reply(interaction, "c", "Ошибка при обработке изображений или параметров.", ephemeral=True, use_followup=True)
-        logging.error(f"Ошибка при обработке: {e}")
+        logging.error(f"Ошибка при создании гифки: {e!r}")
         return
 
-    frames = [remove_alpha(frame) for frame in frames]
-
-    output = io.BytesIO()
-    frames[0].save(
-        output,
-        format="GIF",
-        save_all=True,
-        append_images=frames[1:],
-        duration=durations,
-        loop=0,
-        disposal=2,
-        transparency=0,
-        optimize=False,
-    )
-    output.seek(0)
-
-    discord_file = discord.File(fp=output, filename=f"{gif_name}.gif")
-    await interaction.followup.send(content="Вот ваша гифка:", file=discord_file)
-    logging.info(f"Гифка '{gif_name}.gif' успешно создана пользователем {interaction.user}")
-
-def remove_alpha(image: Image.Image) -> Image.Image:
-    background = Image.new("RGBA", image.size, (255, 0, 255, 0))
-    background.paste(image, mask=image.split()[3])
-    paletted = background.convert("RGBA").convert("P", palette=Image.ADAPTIVE, colors=255)
-    alpha = background.split()[3]
-    mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
-    paletted.paste(0, mask=mask)
-    return paletted
-
-def is_frame_empty(frame: Image.Image, alpha_threshold=10) -> bool:
-    alpha = frame.split()[3]
-    min_alpha = alpha.getextrema()[1] 
-    return min_alpha <= alpha_threshold
+    summary = format_gif_stats(stats)
+    discord_file = discord.File(fp=io.BytesIO(data), filename=f"{gif_name}.gif")
+    await interaction.followup.send(content=f"Вот ваша гифка:\n-# {summary}", file=discord_file)
+    logging.info(f"Гифка '{gif_name}.gif' успешно создана пользователем {interaction.user} ({summary})")
+
+def format_gif_stats(stats: dict) -> str:
+    summary = f"{stats['bytes'] / 1024:.1f} КБ, кадров {stats['frames']}"
+    if stats["written_frames"] != stats["frames"]:
+        summary += f" → {stats['written_frames']}"
+    if stats["baseline_bytes"]:
+        saved = 1 - stats["bytes"] / stats["baseline_bytes"]
+        summary += f", экономия {saved:.0%} относительно покадровой палитры"
+    return summary + f", кодирование {stats['encode_ms']:.0f} мс"
 
 @bot.tree.command(name="report-bug", description="Сообщить об ошибке", guild=discord.Object(id=config['guild_id']))
 @app_commands.describe(
@@ -1159,22 +2463,18 @@ async def close_ticket(
         await send_embed_reply(interaction, "c", "Ошибка при создании ветки с архивом.", ephemeral=True, use_followup=True)
 
     try:
-        sh = gc.open_by_key(config['leaderboard_sheet_id'])
         user_nick = interaction.user.name
 
         for sheet_name in ["General", "Райтер месяца"]:
-            ws = sh.worksheet(sheet_name)
-            data = ws.get_all_values()
-            nicknames = [row[0].strip() for row in data]
-
-            if user_nick in nicknames:
-                row_index = nicknames.index(user_nick) + 1
-                current = ws.cell(row_index, 2).value
-                current_val = int(current) if current and current.isdigit() else 0
-                ws.update_cell(row_index, 2, str(current_val + 1))
+            entry = await sheets.lookup(sheet_name, user_nick)
+
+            if entry:
+                row_index, current_val = entry
+                sheets.queue_cell(sheet_name, row_index, 2, str(current_val + 1))
                 logging.info(f"Пользователю {user_nick} начислен 1 балл на листе {sheet_name}")
             else:
                 logging.warning(f"Пользователь {user_nick} не найден в листе {sheet_name}")
+        await sheets.flush()
     except Exception as e:
         logging.error(f"Ошибка при начислении баллов за закрытие тикета: {e}")
 
@@ -1260,37 +2560,28 @@ async def give_points(
         return
 
     try:
-        sh = gc.open_by_key(config['leaderboard_sheet_id'])
-
+        if note:
+            await sheets.ensure_cols("General", 3)
+        snapshots = {}
         for sheet_name in ["General", "Райтер месяца"]:
-            ws = sh.worksheet(sheet_name)
-            records = ws.get_all_values()
-            nick_col = [row[0].strip() for row in records]
-            if username in nick_col:
-                idx = nick_col.index(username) + 1
-                current = ws.cell(idx, 2).value
-                try:
-                    current_val = int(float(current))
-                except:
-                    current_val = 0
-                new_val = current_val + points
-                ws.update_cell(idx, 2, new_val)
-
-                if sheet_name == "General" and note:
-                    if ws.col_count < 3:
-                        ws.add_cols(1)
-                    existing_note = ws.cell(idx, 3).value
-                    if existing_note:
-                        new_note = existing_note.strip() + " + " + note.strip()
-                    else:
-                        new_note = note.strip()
-                    ws.update_cell(idx, 3, new_note)
-            
-            else:
+            snapshots[sheet_name] = await sheets.snapshot(sheet_name)
+            if username not in snapshots[sheet_name]["index"]:
                 await send_embed_reply(interaction, "c", f"На листе **{sheet_name}** не найден райтер с ником `{username}`.", ephemeral=True, use_followup=True)
                 return
+        for sheet_name, snap in snapshots.items():
+            idx, current_val = snap["index"][username]
+            sheets.queue_cell(sheet_name, idx, 2, current_val + points)
+            if sheet_name == "General" and note:
+                row = snap["rows"][idx - 1]
+                existing_note = row[2] if len(row) > 2 else ""
+                if existing_note:
+                    new_note = existing_note.strip() + " + " + note.strip()
+                else:
+                    new_note = note.strip()
+                sheets.queue_cell(sheet_name, idx, 3, new_note)
+        await sheets.flush()
         await send_embed_reply(interaction, "a", f"Райтеру `{username}` начислено `{points}` баллов." + (f"\nДобавлена заметка: _{note}_." if note else ""), ephemeral=True, use_followup=True)
-        channel = await bot.fetch_channel(config['channel_id'])
+        channel = await channel_resolver.get(config['channel_id'])
         def format_points(n: int) -> str:
             n_mod = n % 100
             if 11 <= n_mod <= 14:
@@ -1325,13 +2616,13 @@ async def create_room(interaction: discord.Interaction, name: str, mode: app_com
     current_room = config.get("game_room", {})
     if current_room.get("thread_id"):
         try:
-            existing_thread = await bot.fetch_channel(current_room["thread_id"])
+            existing_thread = await channel_resolver.get(current_room["thread_id"])
             await send_embed_reply(interaction, "b", f"Игровая комната уже создана: {existing_thread.mention}.\nЗакройте / попросите закрыть её перед созданием новой.", ephemeral=True, use_followup=True)
         except Exception:
             await send_embed_reply(interaction, "b", "Игровая комната уже создана. Закройте её перед созданием новой.", ephemeral=True, use_followup=True)
         return
     try:
-        base_channel = await bot.fetch_channel(config['channel_id'])
+        base_channel = await channel_resolver.get(config['channel_id'])
         thread = await base_channel.create_thread(
             name=name,
             type=discord.ChannelType.private_thread,
@@ -1395,20 +2686,12 @@ class BetModal(Modal, title="Сделать ставку"):
             await send_embed_reply(interaction, "b", "Введите корректное положительное число.", ephemeral=True, use_followup=True)
             return
         try:
-            sh = gc.open_by_key(config['leaderboard_sheet_id'])
-            ws = sh.worksheet('Gambling')
-            rows = ws.get_all_values()
             user_nick = str(self.user.name)
-            user_row_idx = None
-            user_score = 0
-            for i, row in enumerate(rows):
-                if row and row[0].strip() == user_nick:
-                    user_row_idx = i + 1
-                    user_score = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
-                    break
-            if user_row_idx is None:
+            entry = await sheets.lookup('Gambling', user_nick)
+            if entry is None:
                 await send_embed_reply(interaction, "c", "Вас нет в таблице казино.", ephemeral=True, use_followup=True)
                 return
+            user_row_idx, user_score = entry
             game = config.get("game_room", {})
             participants = game.get("participants", {})
             user_id_str = str(self.user.id)
@@ -1431,7 +2714,7 @@ class BetModal(Modal, title="Сделать ставку"):
             config["game_room"] = game
             save_config(config)
             try:
-                ws.update_cell(user_row_idx, 2, str(user_score - bet_value))
+                await sheets.update_cell('Gambling', user_row_idx, 2, str(user_score - bet_value))
                 logging.info("Баллы обновлены в Google Sheets.")
             except Exception as e:
                 logging.error(f"Ошибка при обновлении баллов: {e}")
@@ -1439,7 +2722,7 @@ class BetModal(Modal, title="Сделать ставку"):
             if not participants_msg_id:
                 await send_embed_reply(interaction, "c", "Ошибка: сообщение со списком участников не найдено.", ephemeral=True, use_followup=True)
                 return
-            participants_msg = await self.thread.fetch_message(participants_msg_id)
+            participants_msg = self.thread.get_partial_message(participants_msg_id)
             if participants:
                 desc = "\n".join(f"- **{data['nick']}** — {data['bet']} баллов" for data in participants.values())
             else:
@@ -1580,20 +2863,13 @@ class MainView(View):
         await self.thread.send(file=gif_file)
         await asyncio.sleep(gif_duration)
         try:
-            sh = gc.open_by_key(config['leaderboard_sheet_id'])
-            ws = sh.worksheet('Gambling')
-            rows = ws.get_all_values()
-            winner_row_idx = None
-            for i, row in enumerate(rows):
-                if row and row[0].strip() == winner_nick:
-                    winner_row_idx = i + 1
-                    break
-            if winner_row_idx is None:
+            entry = await sheets.lookup('Gambling', winner_nick)
+            if entry is None:
                 await send_embed_reply(interaction, "c", f"Победитель {winner_nick} не найден в таблице 'Gambling'.", ephemeral=True, use_followup=True)
                 return
-            current_score = int(rows[winner_row_idx - 1][1]) if len(rows[winner_row_idx - 1]) > 1 and rows[winner_row_idx - 1][1].isdigit() else 0
+            winner_row_idx, current_score = entry
             new_score = current_score + total_bet
-            ws.update_cell(winner_row_idx, 2, str(new_score))
+            await sheets.update_cell('Gambling', winner_row_idx, 2, str(new_score))
             embed = discord.Embed(
                 title="🎉 Игра завершена!",
                 description=f"🏆 Победитель: **{winner_nick}**\n💰 Выигрыш: **{total_bet}** баллов!",
@@ -1605,7 +2881,7 @@ class MainView(View):
             save_config(config)
             participants_msg_id = game.get("participants_msg_id")
             if participants_msg_id:
-                participants_msg = await self.thread.fetch_message(participants_msg_id)
+                participants_msg = self.thread.get_partial_message(participants_msg_id)
                 empty_embed = discord.Embed(title="Участники", description="Пока нет участников.", color=0xffc86e)
                 await participants_msg.edit(embed=empty_embed, view=BetView(self.thread))
             await send_embed_reply(interaction, "a", "Игра успешно завершена.", ephemeral=True, use_followup=True)
@@ -1653,80 +2929,54 @@ async def points_manager(
     await interaction.response.defer(ephemeral=True)
     try:
         user_nick = str(interaction.user.name)
-        sh = gc.open_by_key(config['leaderboard_sheet_id'])
         if mode.value == "balance":
-            ws = sh.worksheet("Gambling")
-            rows = ws.get_all_values()
-            for row in rows:
-                if row and row[0].strip() == user_nick:
-                    score = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
-                    await send_embed_reply(interaction, "a", f"💵 Ваш текущий баланс: `{score}` игровых баллов.", ephemeral=True, use_followup=True)
-                    return
+            entry = await sheets.lookup("Gambling", user_nick)
+            if entry:
+                score = entry[1]
+                await send_embed_reply(interaction, "a", f"💵 Ваш текущий баланс: `{score}` игровых баллов.", ephemeral=True, use_followup=True)
+                return
             await send_embed_reply(interaction, "b", "Вы не найдены в таблице 'Gambling'.", ephemeral=True, use_followup=True)
         elif mode.value == "convert":
             if amount is None or amount <= 0:
                 await send_embed_reply(interaction, "b", "Укажите корректное количество баллов для конвертации.", ephemeral=True, use_followup=True)
                 return
-            ws_writer = sh.worksheet("Райтер месяца")
-            rows_writer = ws_writer.get_all_values()
-            row_idx = None
-            current_points = 0
-            for i, row in enumerate(rows_writer):
-                if row and row[0].strip() == user_nick:
-                    row_idx = i + 1
-                    current_points = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
-                    break
-            if row_idx is None:
+            entry = await sheets.lookup("Райтер месяца", user_nick)
+            if entry is None:
                 await send_embed_reply(interaction, "b", "Вы не найдены в таблице 'Райтер месяца'.", ephemeral=True, use_followup=True)
                 return
+            row_idx, current_points = entry
             if current_points < amount:
                 await send_embed_reply(interaction, "b", f"Недостаточно очков. У вас: `{current_points}`", ephemeral=True, use_followup=True)
                 return
             new_writer_points = current_points - amount
             game_points = amount * 1000
-            ws_writer.update_cell(row_idx, 2, str(new_writer_points))
-            ws_gamble = sh.worksheet("Gambling")
-            rows_gamble = ws_gamble.get_all_values()
-            gamble_row_idx = None
-            gamble_points = 0
-            for i, row in enumerate(rows_gamble):
-                if row and row[0].strip() == user_nick:
-                    gamble_row_idx = i + 1
-                    gamble_points = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
-                    break
-            if gamble_row_idx:
-                ws_gamble.update_cell(gamble_row_idx, 2, str(gamble_points + game_points))
+            sheets.queue_cell("Райтер месяца", row_idx, 2, str(new_writer_points))
+            gamble_entry = await sheets.lookup("Gambling", user_nick)
+            if gamble_entry:
+                gamble_row_idx, gamble_points = gamble_entry
+                sheets.queue_cell("Gambling", gamble_row_idx, 2, str(gamble_points + game_points))
             else:
-                ws_gamble.append_row([user_nick, str(game_points)])
+                sheets.queue_append("Gambling", [user_nick, str(game_points)])
+            await sheets.flush()
             await send_embed_reply(interaction, "a", f"♻️ Конвертировано `{amount}` баллов в `{game_points}` игровых баллов.", ephemeral=True, use_followup=True)
         elif mode.value == "transfer":
             if amount is None or amount <= 0 or recipient is None:
                 await send_embed_reply(interaction, "b", "Укажите пользователя и корректное количество баллов.", ephemeral=True, use_followup=True)
                 return
             recipient_nick = str(recipient.name)
-            ws = sh.worksheet("Gambling")
-            rows = ws.get_all_values()
-            sender_idx = None
-            recipient_idx = None
-            sender_score = 0
-            recipient_score = 0
-            for i, row in enumerate(rows):
-                if row:
-                    if row[0].strip() == user_nick:
-                        sender_idx = i + 1
-                        sender_score = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
-                    elif row[0].strip() == recipient_nick:
-                        recipient_idx = i + 1
-                        recipient_score = int(row[1]) if len(row) > 1 and row[1].isdigit() else 0
+            sender_idx, sender_score = await sheets.lookup("Gambling", user_nick) or (None, 0)
+            recipient_idx, recipient_score = (None, 0)
+            if recipient_nick != user_nick:
+                recipient_idx, recipient_score = await sheets.lookup("Gambling", recipient_nick) or (None, 0)
             if sender_idx is None or sender_score < amount:
                 await send_embed_reply(interaction, "b", "Недостаточно баллов для перевода.", ephemeral=True, use_followup=True)
                 return
-            ws.update_cell(sender_idx, 2, str(sender_score - amount))
-            if recipient_idx:
-                ws.update_cell(recipient_idx, 2, str(recipient_score + amount))
-            else:
+            if not recipient_idx:
                 await send_embed_reply(interaction, "c", f"Пользователь {recipient.mention} не найден. Передача не выполнена.", ephemeral=True, use_followup=True)
                 return
+            sheets.queue_cell("Gambling", sender_idx, 2, str(sender_score - amount))
+            sheets.queue_cell("Gambling", recipient_idx, 2, str(recipient_score + amount))
+            await sheets.flush("Gambling")
             await send_embed_reply(interaction, "a", f"💸 Переведено `{amount}` баллов пользователю {recipient.mention}.", ephemeral=True, use_followup=True)
     except Exception as e:
         logging.error(f"Ошибка в points_manager: {e}")
@@ -1779,86 +3029,138 @@ async def monthly_event_task():
     now = datetime.now()
     if now.day == 1:
         await run_monthly_event()
-@tasks.loop(seconds=30)
-async def auto_thread_creator():
-    if "auto_threads" not in config or not config["auto_threads"]:
-        return
-    for channel_id in config["auto_threads"]:
-        try:
-            channel = await bot.fetch_channel(int(channel_id))
-            messages = [m async for m in channel.history(limit=25)]
-            for msg in reversed(messages):
-                if msg.author.bot:
-                    if msg.content.startswith("Создана ветка") or any(thread.name in msg.content for thread in channel.threads):
-                        continue
-                if msg.type != discord.MessageType.default:
-                    continue
-                if msg.thread is not None:
-                    continue
-
-                await channel.create_thread(
-                    name=f"Обсуждение: {msg.author.name}",
-                    message=msg,
-                    auto_archive_duration=60
-                )
-                await asyncio.sleep(1)
-        except Exception as e:
-            logging.error(f"[AutoThread] Ошибка в канале {channel_id}: {e}")
+class AutoThreadQueue:
+    def __init__(self, pace: float = 1.0, idle_timeout: float = 300, catch_up_limit: int = 50, remember: int = 1000):
+        self.pace = pace
+        self.idle_timeout = idle_timeout
+        self.catch_up_limit = catch_up_limit
+        self.remember = remember
+        self.queues = {}
+        self.workers = {}
+        self.seen = OrderedDict()
+        self.caught_up = False
+        self.created = 0
+
+    def enabled(self, channel_id: int) -> bool:
+        return str(channel_id) in (config.get("auto_threads") or {})
+
+    def eligible(self, msg: discord.Message) -> bool:
+        if msg.type != discord.MessageType.default or msg.thread is not None or msg.flags.has_thread:
+            return False
+        if msg.author.bot:
+            channel_threads = getattr(msg.channel, "threads", [])
+            if msg.content.startswith("Создана ветка") or any(thread.name in msg.content for thread in channel_threads):
+                return False
+        return True
+
+    def enqueue(self, msg: discord.Message) -> bool:
+        if not self.enabled(msg.channel.id) or msg.id in self.seen or not self.eligible(msg):
+            return False
+        self.seen[msg.id] = True
+        if len(self.seen) > self.remember:
+            self.seen.popitem(last=False)
+        queue = self.queues.get(msg.channel.id)
+        if queue is None:
+            queue = self.queues[msg.channel.id] = asyncio.Queue()
+        queue.put_nowait(msg)
+        worker = self.workers.get(msg.channel.id)
+        if worker is None or worker.done():
+            self.workers[msg.channel.id] = asyncio.create_task(self.work(msg.channel.id, queue))
+        return True
+
+    async def work(self, channel_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self.workers.pop(channel_id, None)
+                    self.queues.pop(channel_id, None)
+                    return
+                continue
+            if not self.enabled(channel_id):
+                continue
+            try:
+                await msg.create_thread(name=f"Обсуждение: {msg.author.name}", auto_archive_duration=60)
+                self.created += 1
+            except discord.HTTPException as e:
+                logging.warning(f"[AutoThread] Не удалось создать ветку для {msg.id} в канале {channel_id}: {e}")
+            except Exception as e:
+                logging.error(f"[AutoThread] Ошибка в канале {channel_id}: {e}")
+            await asyncio.sleep(self.pace)
+
+    async def catch_up(self):
+        if self.caught_up:
+            return
+        self.caught_up = True
+        for channel_id in list(config.get("auto_threads") or {}):
+            try:
+                channel = await channel_resolver.get(channel_id)
+                messages = [m async for m in channel.history(limit=self.catch_up_limit)]
+                queued = sum(self.enqueue(msg) for msg in reversed(messages))
+                if queued:
+                    logging.info(f"[AutoThread] Догоняем канал {channel_id}: {queued} сообщений без веток.")
+            except Exception as e:
+                logging.error(f"[AutoThread] Ошибка при проверке канала {channel_id}: {e}")
+
+thread_queue = AutoThreadQueue(
+    config.get("auto_thread_pace", 1.0),
+    config.get("auto_thread_idle_timeout", 300),
+    config.get("auto_thread_catch_up_limit", 50)
+)
 
 @bot.event
 async def on_message(message):
-    global mention_times, ignore_until
+    thread_queue.enqueue(message)
     if message.author == bot.user or not bot.user.mentioned_in(message):
         return
     if str(message.channel.id) not in (str(config.get("channel_id")), "1302977169978425374"):
         return
-    now = datetime.now(UTC)
-    mention_times = [t for t in mention_times if (now - t).total_seconds() <= 10]
-    mention_times.append(now)
-    if len(mention_times) > 10:
-        ignore_until = now + timedelta(seconds=60)
-        mention_times.clear()
-        logging.warning(f"[SPAM] Включён игнор упоминаний до {ignore_until.isoformat()}")
-        return
-    if ignore_until and now < ignore_until:
+    if not spam_guard.allow(message.author.id, message.channel.id):
         return
     query = re.sub(rf"<@!?{bot.user.id}>", "", message.content).strip().lower()
-    author_name = message.author.display_name
     replied_text = ""
     if message.reference and message.reference.message_id:
         try:
-            replied_message = await message.channel.fetch_message(message.reference.message_id)
+            replied_message = message.reference.resolved
+            if not isinstance(replied_message, discord.Message):
+                replied_message = await message.channel.fetch_message(message.reference.message_id)
             replied_text = replied_message.content.strip()
         except Exception as e:
             logging.warning(f"Не удалось получить сообщение, на которое отвечали: {e}")
     if replied_text:
         full_prompt = (
-            f"{author_name} пишет тебе: {query}."
+            f"Пользователь пишет тебе: {query}."
             f"Он ссылается на этот текст: \"{replied_text}\""
         )
     else:
-        full_prompt = f"{author_name} пишет тебе: {query}"
+        full_prompt = f"Пользователь пишет тебе: {query}"
     if not config or "flags" not in config or "responses" not in config:
         await message.reply("Извините, я не могу общаться по техническим причинам.")
         return
     if not query:
         await message.reply(get_random_unknown_reply())
         return
-    matched_flags = set()
-    words = re.findall(r"\b\w+\b", query)
-    response = await query_openrouter(full_prompt)
+    words = QUERY_WORD_RE.findall(query)
+    cache_key = normalize_prompt(full_prompt)
+    if config.get("ai_stream", False):
+        streamed = {"message": None}
+        response = await answer_cache.fetch(cache_key, lambda: stream_reply(message, full_prompt, streamed))
+        if streamed["message"] is not None:
+            return
+    else:
+        response = await answer_cache.fetch(cache_key, lambda: query_openrouter(full_prompt))
     if response:
         await message.reply(sanitize_mentions(response, message.guild))
         return
     else:
         logging.info("AI не сработал, fallback на ключи.")
-    has_L = any(kw.lower() in words for kw in config.get("flags", {}).get("L", []))
-    has_M = any(kw.lower() in words for kw in config.get("flags", {}).get("M", []))
+    matched = intent_matcher.match(words)
+    has_L = intent_matcher.has(matched, "L")
+    has_M = intent_matcher.has(matched, "M")
     if has_L and has_M:
         cleaned = re.sub(rf"<@!?{bot.user.id}>", "", message.content, flags=re.IGNORECASE).strip()
-        trigger_words = config["flags"].get("M", [])
-        trigger_regex = r"\b(" + "|".join(re.escape(w) for w in trigger_words) + r")\b"
-        match = re.search(trigger_regex, cleaned, flags=re.IGNORECASE)
+        match = intent_matcher.trigger_re.search(cleaned)
         if match:
             trigger_end = match.end()
             trimmed = cleaned[trigger_end:].strip()
@@ -1881,9 +3183,7 @@ async def on_message(message):
         return
     elif has_M:
         cleaned = re.sub(rf"<@!?{bot.user.id}>", "", message.content, flags=re.IGNORECASE).strip()
-        trigger_words = config["flags"].get("M", [])
-        trigger_regex = r"\b(" + "|".join(re.escape(w) for w in trigger_words) + r")\b"
-        match = re.search(trigger_regex, cleaned, flags=re.IGNORECASE)
+        match = intent_matcher.trigger_re.search(cleaned)
         if match:
             trigger_start = match.start()
             trigger_end = match.end()
@@ -1902,22 +3202,10 @@ async def on_message(message):
         else:
             await message.reply("Не найдено ключевое слово.")
         return
-    for flag, keywords in config["flags"].items():
-        for kw in keywords:
-            if kw.lower() in words:
-                matched_flags.add(flag)
-                break
-    if not matched_flags:
+    if not matched:
         await message.reply(get_random_unknown_reply())
         return
-    response_key = None
-    possible_keys = config["responses"]
-    sorted_keys = sorted(possible_keys.keys(), key=lambda k: -len(k.split("+")))
-    for key in sorted_keys:
-        parts = set(key.split("+"))
-        if parts.issubset(matched_flags):
-            response_key = key
-            break
+    response_key = intent_matcher.response_key(matched)
     if response_key:
         await message.reply(config["responses"][response_key])
     else:
@@ -1961,6 +3249,7 @@ async def on_ready():
     synced = await bot.tree.sync(guild=discord.Object(id=config['guild_id']))
     logging.info(f"Синхронизировано {len(synced)} команд.")
     if config.get("is_updating") and not update_task_message.is_running():
+        update_task_message.change_interval(minutes=config.get("task_update_interval_minutes", 60))
         update_task_message.start()
         logging.info("Автообновление задач запущено при старте бота.")
     if config.get('is_lb_updating') and not update_leaderboard_task.is_running():
@@ -1969,14 +3258,15 @@ async def on_ready():
     if config.get("monthly_event_enabled") and not monthly_event_task.is_running():
         monthly_event_task.start()
         logging.info("Запущено автообновление Райтера месяца.")
-    if not auto_thread_creator.is_running():
-        auto_thread_creator.start()
-        logging.info("Запущено автосоздание веток.")
+    if not thread_queue.caught_up:
+        asyncio.create_task(thread_queue.catch_up())
+        logging.info("Запущена проверка пропущенных сообщений для автоветок.")
     if not log_file_maintenance.is_running():
         log_file_maintenance.start()
         logging.info("Запущено периодическое обслуживание лога.")
-try:
-    bot.run(os.getenv("BOT_TOKEN"))
-except Exception as e:
-    logging.critical(f"Не удалось запустить бота: {e}")
+if __name__ == "__main__":
+    try:
+        bot.run(os.getenv("BOT_TOKEN"))
+    except Exception as e:
+        logging.critical(f"Не удалось запустить бота: {e}")
 